@@ -1,6 +1,7 @@
 __author__ = 'haohanwang'
 
 import numpy as np
+from kernels import z_dual_update, group_z_dual_update
 
 
 class ADMM:
@@ -10,7 +11,14 @@ class ADMM:
         self.y = 0
 
     def run(self, cost, l_x, l_z, const, x, z, l_x_jac, l_z_jac, tol = 1e-3, l_x_hessian=None, l_z_hessian=None, sub_iter=1,
-            step_size=1):
+            step_size=1, lam=None, group_size=None, verbose=True):
+        """
+        With lam given, the g-term is taken to be lam * ||z||_1 with the
+        constraint x - z = 0: the z-update is then the exact prox and is fused
+        with the dual update and the residual norms (see ADMM.kernels), and
+        l_z, l_z_jac are not used. With group_size given as well, the g-term is
+        the group lasso penalty over consecutive blocks of group_size entries.
+        """
         self.y = np.zeros(x.shape)
         self.cost = cost
         self.lx = l_x
@@ -24,23 +32,36 @@ class ADMM:
         self.lzh = l_z_hessian
         self.sub_iter = sub_iter
         self.ss = step_size
+        self.lam = lam
+        self.group_size = group_size
+        self.iterations = 0
+        self.r_norm = None
+        self.s_norm = None
 
         prev = self.cost(self.x, self.z, self.y)
-        print prev
+        if verbose:
+            print prev
         curr = 0
         for i in range(self.maxIter):
+            self.iterations = i + 1
             self.update_f()
-            self.update_g()
-            self.update_Lagrangian()
+            if self.lam is None:
+                self.update_g()
+                self.update_Lagrangian()
+            else:
+                self.update_g_prox()
             curr = self.cost(self.x, self.z, self.y)
-            print curr,
+            if verbose:
+                print curr,
             if prev - curr <= tol:
-                print 'Early Stop, program converges'
-                print 'Final cost', curr
+                if verbose:
+                    print 'Early Stop, program converges'
+                    print 'Final cost', curr
                 return self.x, self.z, self.y, curr
             prev = curr
-        print 'run out of iterations'
-        print 'Final cost', curr
+        if verbose:
+            print 'run out of iterations'
+            print 'Final cost', curr
         return self.x, self.z, self.y, curr
 
     def update_f(self):
@@ -59,5 +80,12 @@ class ADMM:
             for i in range(self.sub_iter):
                 self.z += self.ss * np.linalg.inv(self.lzh(self.x, self.z, self.y))
 
+    def update_g_prox(self):
+        if self.group_size is None:
+            self.r_norm, self.s_norm = z_dual_update(self.x, self.z, self.y, self.rho, self.lam / self.rho)
+        else:
+            self.r_norm, self.s_norm = group_z_dual_update(self.x, self.z, self.y, self.rho, self.lam / self.rho,
+                                                           self.group_size)
+
     def update_Lagrangian(self):
         self.y += self.rho * (self.const(self.x, self.z))
\ No newline at end of file
@@ -0,0 +1,193 @@
+__author__ = 'haohanwang'
+
+import time
+import multiprocessing
+from Queue import Empty
+
+import numpy as np
+from kernels import consensus_update
+from compression import Link
+
+
+class LocalLeastSquares:
+    """
+    Local subproblem of one data shard in consensus Lasso
+
+        x_i = argmin 0.5 ||A_i x - b_i||^2 + y_i'(x - z) + rho/2 ||x - z||^2
+
+    (A_i'A_i + rho I) only depends on the shard, so its inverse is computed once
+    and every later solve is a single matrix-vector product.
+    """
+    def __init__(self, A, b, rho):
+        self.Atb = np.dot(A.T, b)
+        self.inv = np.linalg.inv(np.dot(A.T, A) + rho * np.eye(A.shape[1]))
+        self.rho = rho
+
+    def solve(self, z, y):
+        return np.dot(self.inv, self.Atb + self.rho * z - y)
+
+
+def _worker_loop(i, A, b, rho, delay, inbox, outbox, codec='raw'):
+    local = LocalLeastSquares(A, b, rho)
+    p = A.shape[1]
+    # z and y_i come in and x_i goes out as compressed changes; z and y_i
+    # have separate links, their scales differ
+    down_z = Link(codec, p)
+    down_y = Link(codec, p)
+    up = Link(codec, p)
+    while True:
+        msg = inbox.get()
+        if msg is None:
+            break
+        k, payload_z, payload_y = msg
+        z = down_z.receive(payload_z).reshape(p, 1)
+        y = down_y.receive(payload_y).reshape(p, 1)
+        if delay:
+            # artificial straggler, only used to exercise the asynchronous mode
+            time.sleep(delay)
+        outbox.put((i, k, up.send(local.solve(z, y))))
+    outbox.cancel_join_thread()
+
+
+class AsyncConsensusADMM:
+    """
+    Asynchronous consensus ADMM for
+
+        min sum_i 0.5 ||A_i x_i - b_i||^2 + lam * ||z||_1   s.t.  x_i - z = 0
+
+    with bounded staleness. Each shard lives in its own worker process. The
+    coordinator owns z and the duals y_i; it updates z as soon as any
+    min_workers of the N workers have reported, but never lets a worker fall
+    more than tau rounds behind: a worker whose last report is tau - 1 rounds
+    old is waited for before the next z-update. min_workers=N and tau=1 give
+    the usual synchronous consensus ADMM.
+
+    Messages go through compression.Link with the given codec ('raw', 'q8',
+    'q1', 'topk:<fraction>', 'topk+q8:<fraction>'); trace records the bytes
+    moved and the residuals of every round.
+    """
+    def __init__(self, rho, lam, min_workers=None, tau=1, maxIter=1e3, codec='raw'):
+        self.rho = rho
+        self.lam = lam
+        self.min_workers = min_workers
+        self.tau = max(int(tau), 1)
+        self.maxIter = int(maxIter)
+        self.codec = codec
+        self.stats = []
+        self.trace = []
+
+    def run(self, A_blocks, b_blocks, tol=1e-4, delays=None):
+        """
+        :param A_blocks: list of the N data shards
+        :param b_blocks: list of the N response shards
+        :param delays: optional list of N artificial per-round delays (seconds)
+        """
+        n = len(A_blocks)
+        p = A_blocks[0].shape[1]
+        S = n if self.min_workers is None else min(self.min_workers, n)
+        if delays is None:
+            delays = [0] * n
+
+        self.x = np.zeros((n, p, 1))
+        self.y = np.zeros((n, p, 1))
+        self.z = np.zeros((p, 1))
+        self.stats = [{'updates': 0, 'delays': [], 'max_staleness': 0} for i in range(n)]
+        self.trace = []
+        self.down_z = [Link(self.codec, p) for i in range(n)]
+        self.down_y = [Link(self.codec, p) for i in range(n)]
+        self.up = [Link(self.codec, p) for i in range(n)]
+        self.round_bytes = 0
+        staleness = [0] * n
+        sent = [0.] * n
+
+        outbox = multiprocessing.Queue()
+        inboxes = [multiprocessing.Queue() for i in range(n)]
+        workers = [multiprocessing.Process(target=_worker_loop,
+                                           args=(i, A_blocks[i], b_blocks[i], self.rho, delays[i],
+                                                 inboxes[i], outbox, self.codec))
+                   for i in range(n)]
+        for w in workers:
+            w.daemon = True
+            w.start()
+        for i in range(n):
+            sent[i] = time.time()
+            inboxes[i].put((0,) + self._task(i))
+
+        k = 0
+        try:
+            for k in range(1, self.maxIter + 1):
+                arrived = set()
+                while len(arrived) < S or \
+                        any(staleness[i] >= self.tau - 1 and i not in arrived for i in range(n)):
+                    self._receive(outbox.get(), arrived, sent)
+                # pick up whatever else has already finished without blocking
+                while True:
+                    try:
+                        self._receive(outbox.get_nowait(), arrived, sent)
+                    except Empty:
+                        break
+
+                active = np.zeros(n, dtype=np.bool_)
+                active[list(arrived)] = True
+                r, s = consensus_update(self.x, self.z, self.y, self.rho, self.lam / (n * self.rho), active)
+                for i in range(n):
+                    if active[i]:
+                        staleness[i] = 0
+                        sent[i] = time.time()
+                        inboxes[i].put((k,) + self._task(i))
+                    else:
+                        staleness[i] += 1
+                        self.stats[i]['max_staleness'] = max(self.stats[i]['max_staleness'], staleness[i])
+                self.trace.append({'round': k, 'bytes': self.round_bytes, 'r': r, 's': s})
+                self.round_bytes = 0
+
+                if r <= tol and s <= tol:
+                    print 'Early Stop, program converges after', k, 'rounds'
+                    break
+            else:
+                print 'run out of iterations'
+        finally:
+            for q in inboxes:
+                q.put(None)
+            for w in workers:
+                w.join(1)
+                if w.is_alive():
+                    w.terminate()
+        self.iterations = k
+        return self.z, self.x, self.y
+
+    def _task(self, i):
+        # the queue pickles the payloads in its feeder thread while z and y_i
+        # move on; lossy payloads are fresh arrays, lossless ones views on
+        # z and y_i that need copying
+        payloads = (self.down_z[i].send(self.z), self.down_y[i].send(self.y[i]))
+        if self.down_z[i].codec.lossless:
+            payloads = tuple(pl.copy() for pl in payloads)
+        self.round_bytes += sum(pl.nbytes for pl in payloads)
+        return payloads
+
+    def _receive(self, msg, arrived, sent):
+        i, k, payload = msg
+        self.x[i] = self.up[i].receive(payload).reshape(self.x[i].shape)
+        self.round_bytes += payload.nbytes
+        arrived.add(i)
+        self.stats[i]['updates'] += 1
+        self.stats[i]['delays'].append(time.time() - sent[i])
+
+    def delay_statistics(self):
+        """
+        Per-worker number of reports, mean/max round-trip time in seconds and
+        the largest number of z-updates the worker missed in a row.
+        """
+        r = []
+        for st in self.stats:
+            d = st['delays'] or [0.]
+            r.append({'updates': st['updates'],
+                      'mean_delay': float(np.mean(d)),
+                      'max_delay': float(np.max(d)),
+                      'max_staleness': st['max_staleness']})
+        return r
+
+    def bytes_moved(self):
+        """total bytes sent both ways over all rounds"""
+        return sum(t['bytes'] for t in self.trace)
@@ -0,0 +1,70 @@
+__author__ = 'haohanwang'
+
+import numpy as np
+from kernels import z_dual_update
+
+
+class OnlineADMM:
+    """
+    Stochastic (online) ADMM for problems of the form
+
+        min_x  E[f(x; batch)] + lam * ||z||_1   s.t.  x - z = 0
+
+    Each minibatch drawn from a generator gives one linearized x-step
+
+        x = argmin  g'x + y'(x - z) + rho/2 ||x - z||^2 + 1/(2 eta_t) ||x - x_prev||^2
+
+    where g is the minibatch gradient, followed by the exact prox for z
+    (soft-thresholding) and the dual ascent on y. Only x, z and y are kept,
+    so the state is O(p) no matter how many samples have streamed through.
+    """
+    def __init__(self, rho, lam, eta=1.0, maxIter=1e4, decay=True):
+        self.rho = rho
+        self.lam = lam
+        self.eta = eta
+        self.maxIter = int(maxIter)
+        self.decay = decay
+        self.t = 0
+        self.x = None
+        self.z = None
+        self.y = None
+
+    def initialize(self, x, z=None):
+        self.x = x
+        self.z = np.array(x if z is None else z, dtype=np.float64)
+        self.y = np.zeros(x.shape)
+        self.t = 0
+
+    def step(self, grad, batch):
+        """
+        Consume one minibatch: linearized x-update, prox z-update, dual ascent.
+        Returns the change of z, usable as a cheap progress measure.
+        """
+        self.t += 1
+        eta = self.eta / np.sqrt(self.t) if self.decay else self.eta
+        g = grad(self.x, *batch)
+        # closed form of the linearized x-step
+        self.x *= 1. / eta
+        self.x += self.rho * self.z - self.y - g
+        self.x /= self.rho + 1. / eta
+        r, s = z_dual_update(self.x, self.z, self.y, self.rho, self.lam / self.rho)
+        return s / self.rho
+
+    def run(self, batches, grad, x, z=None, tol=None):
+        """
+        :param batches: iterable (e.g. a generator) of minibatches, each a tuple
+                        of arguments passed to grad after x, e.g. (X_b, y_b)
+        :param grad: grad(x, *batch), gradient of the smooth loss on one batch
+        :param x: initial point
+        :param tol: optional, stop once the change of z drops below tol
+        """
+        self.initialize(x, z)
+        for batch in batches:
+            change = self.step(grad, batch)
+            if tol is not None and change <= tol:
+                print 'Early Stop, program converges after', self.t, 'batches'
+                return self.x, self.z, self.y
+            if self.t >= self.maxIter:
+                break
+        print 'consumed', self.t, 'batches'
+        return self.x, self.z, self.y
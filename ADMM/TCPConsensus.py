@@ -0,0 +1,298 @@
+__author__ = 'haohanwang'
+
+import time
+import struct
+import select
+import socket
+import multiprocessing
+
+import numpy as np
+from ConsensusADMM import LocalLeastSquares
+from kernels import consensus_update
+from compression import Link
+
+# Every message is a fixed header (kind, worker id, round, payload bytes)
+# followed by the payloads of compression.Link, z's then y_i's for a task.
+# Their sizes are fixed by the codec, which splits them again. Arrays are
+# handed to the socket and received into preallocated arrays directly, no
+# pickling and no intermediate bytes objects.
+HEADER = struct.Struct('!BHII')
+HELLO, UPDATE, TASK, STOP = 0, 1, 2, 3
+DTYPE = np.dtype('<f8')
+
+
+def send_message(sock, kind, worker, k, *bufs):
+    sock.sendall(HEADER.pack(kind, worker, k, sum(b.nbytes for b in bufs)))
+    for b in bufs:
+        sock.sendall(b)
+
+
+def _recv_into(sock, view):
+    got = 0
+    while got < len(view):
+        n = sock.recv_into(view[got:], len(view) - got)
+        if n == 0:
+            raise socket.error('connection closed')
+        got += n
+
+
+def recv_header(sock, header=None):
+    if header is None:
+        header = bytearray(HEADER.size)
+    _recv_into(sock, memoryview(header))
+    return HEADER.unpack(bytes(header))
+
+
+def recv_payload(sock, buf, nbytes=None):
+    view = buf.reshape(-1).view(np.uint8)[:nbytes]
+    _recv_into(sock, memoryview(view))
+    return view
+
+
+def _connect(address, retries, wait=0.1):
+    for i in range(retries):
+        try:
+            return socket.create_connection(address)
+        except socket.error:
+            time.sleep(wait)
+    raise socket.error('could not reach the coordinator at %s:%i' % address)
+
+
+def run_worker(address, i, A, b, rho, retries=100, drop_after=None, codec='raw'):
+    """
+    Host one data shard: wait for (z, y_i), solve the local subproblem and send
+    x_i back, until the coordinator says stop. A lost connection is re-opened
+    and announced with a new HELLO; the coordinator then repeats the last task.
+    Both directions go through compression.Link with the given codec, and
+    both ends start their links over on a new connection. Raises
+    socket.error once the coordinator cannot be reached in retries attempts.
+
+    :param drop_after: close the connection once after this many rounds, only
+                       used to exercise reconnects
+    """
+    local = LocalLeastSquares(A, b, rho)
+    p = A.shape[1]
+    down_z = Link(codec, p)
+    down_y = Link(codec, p)
+    up = Link(codec, p)
+    m = up.codec.payload_bytes(p)
+    buf = np.empty(2 * m, dtype=np.uint8)
+    header = bytearray(HEADER.size)
+    sock = None
+    rounds = 0
+    while True:
+        try:
+            if sock is None:
+                sock = _connect(address, retries)
+                for link in (down_z, down_y, up):
+                    link.reset()
+                send_message(sock, HELLO, i, 0)
+            kind, _, k, n = recv_header(sock, header)
+            if kind == STOP:
+                break
+            recv_payload(sock, buf, n)
+            z = down_z.receive(buf[:m]).reshape(p, 1)
+            y = down_y.receive(buf[m:]).reshape(p, 1)
+            send_message(sock, UPDATE, i, k, up.send(local.solve(z, y)))
+            rounds += 1
+            if drop_after is not None and rounds == drop_after:
+                sock.close()
+                sock = None
+        except socket.error:
+            if sock is None:
+                # _connect ran out of retries: the coordinator is gone
+                raise
+            sock.close()
+            sock = None
+    sock.close()
+
+
+class TCPCoordinator:
+    """
+    Coordinator of synchronous consensus Lasso over TCP. It owns z and the
+    duals y_i; the workers (see run_worker) own the data shards and only ever
+    see z and their own y_i. Workers may drop and reconnect at any time, an
+    outstanding task is re-sent to the new connection. Messages are encoded
+    with codec (see compression); trace records the bytes moved and the
+    residuals of every round.
+
+    run raises socket.timeout once a worker has been disconnected, or no
+    worker has sent anything, for worker_timeout seconds.
+    """
+    def __init__(self, rho, lam, n_workers, p, address=('127.0.0.1', 0), maxIter=1e3, codec='raw',
+                 worker_timeout=60.):
+        self.rho = rho
+        self.lam = lam
+        self.n = n_workers
+        self.p = p
+        self.maxIter = int(maxIter)
+        self.codec = codec
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(n_workers)
+        self.address = self.listener.getsockname()
+        self.worker_timeout = worker_timeout
+        self.reconnects = 0
+
+    def run(self, tol=1e-4):
+        n, p = self.n, self.p
+        self.x = np.zeros((n, p, 1), dtype=DTYPE)
+        self.y = np.zeros((n, p, 1), dtype=DTYPE)
+        self.z = np.zeros((p, 1), dtype=DTYPE)
+        self.socks = [None] * n
+        self.down_z = [Link(self.codec, p) for i in range(n)]
+        self.down_y = [Link(self.codec, p) for i in range(n)]
+        self.up = [Link(self.codec, p) for i in range(n)]
+        self.buf = np.empty(self.up[0].codec.payload_bytes(p), dtype=np.uint8)
+        self.trace = []
+        self.round_bytes = 0
+        self.round = 0
+        self.pending = set(range(n))
+        # when each worker without a connection lost it (or the run started)
+        self.gone = dict((i, time.time()) for i in range(n))
+        header = bytearray(HEADER.size)
+
+        k = 0
+        try:
+            while any(s is None for s in self.socks):
+                self._poll(header, resend=False)
+            for i in range(n):
+                self._send_task(i)
+
+            for k in range(1, self.maxIter + 1):
+                while self.pending:
+                    self._poll(header)
+                r, s = consensus_update(self.x, self.z, self.y, self.rho, self.lam / (n * self.rho))
+                self.trace.append({'round': k, 'bytes': self.round_bytes, 'r': r, 's': s})
+                self.round_bytes = 0
+                if r <= tol and s <= tol:
+                    print 'Early Stop, program converges after', k, 'rounds'
+                    break
+                self.round = k
+                self.pending = set(range(n))
+                for i in range(n):
+                    self._send_task(i)
+            else:
+                print 'run out of iterations'
+        finally:
+            self.iterations = k
+            self.close()
+        return self.z, self.x, self.y
+
+    def close(self):
+        for i, s in enumerate(self.socks):
+            if s is not None:
+                try:
+                    send_message(s, STOP, i, self.round)
+                except socket.error:
+                    pass
+                s.close()
+        self.socks = [None] * self.n
+        self.listener.close()
+
+    def bytes_moved(self):
+        """total bytes sent both ways over all rounds"""
+        return sum(t['bytes'] for t in self.trace)
+
+    def _send_task(self, i):
+        if self.socks[i] is None:
+            # sent again as soon as the worker reconnects
+            return
+        payload_z = self.down_z[i].send(self.z)
+        payload_y = self.down_y[i].send(self.y[i])
+        try:
+            send_message(self.socks[i], TASK, i, self.round, payload_z, payload_y)
+            self.round_bytes += payload_z.nbytes + payload_y.nbytes
+        except socket.error:
+            self._drop(i)
+
+    def _drop(self, i):
+        self.socks[i].close()
+        self.socks[i] = None
+        self.gone[i] = time.time()
+
+    def _accept(self, header, resend=True):
+        conn, _ = self.listener.accept()
+        try:
+            kind, i, _, _ = recv_header(conn, header)
+        except socket.error:
+            conn.close()
+            return
+        if kind != HELLO or i >= self.n:
+            conn.close()
+            return
+        if self.socks[i] is not None:
+            self._drop(i)
+        self.socks[i] = conn
+        del self.gone[i]
+        # the worker starts its links over on every connection
+        for link in (self.down_z[i], self.down_y[i], self.up[i]):
+            link.reset()
+        if resend:
+            self.reconnects += 1
+            if i in self.pending:
+                self._send_task(i)
+
+    def _poll(self, header, resend=True):
+        now = time.time()
+        timeout = self.worker_timeout
+        if self.gone:
+            i, since = min(self.gone.items(), key=lambda item: item[1])
+            if now - since > self.worker_timeout:
+                raise socket.timeout('worker %i has been disconnected for more than %gs' %
+                                     (i, self.worker_timeout))
+            timeout = min(timeout, since + self.worker_timeout - now)
+        live = [s for s in self.socks if s is not None]
+        readable, _, _ = select.select([self.listener] + live, [], [], timeout)
+        if not readable and not self.gone:
+            raise socket.timeout('no worker has sent anything for %gs' % self.worker_timeout)
+        for s in readable:
+            if s is self.listener:
+                self._accept(header, resend)
+                continue
+            if s not in self.socks:
+                continue
+            i = self.socks.index(s)
+            lossless = self.up[i].codec.lossless
+            try:
+                kind, _, k, m = recv_header(s, header)
+                current = k == self.round
+                # x_i itself is what a lossless payload of this round holds;
+                # a late one from an earlier round is read and dropped
+                payload = recv_payload(s, self.x[i] if lossless and current else self.buf, m)
+            except socket.error:
+                self._drop(i)
+                continue
+            if not lossless:
+                # applied to the link either way, the worker's end has moved on
+                value = self.up[i].receive(payload)
+                if current:
+                    self.x[i] = value.reshape(self.x[i].shape)
+            self.round_bytes += m
+            if current:
+                self.pending.discard(i)
+
+
+def run_localhost(A_blocks, b_blocks, rho, lam, tol=1e-4, maxIter=1e3, drop_after=None, codec='raw'):
+    """
+    Run the TCP consensus solver on this machine, one process per shard
+    standing in for a remote node.
+    """
+    n = len(A_blocks)
+    coordinator = TCPCoordinator(rho, lam, n, A_blocks[0].shape[1], maxIter=maxIter, codec=codec)
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(coordinator.address, i, A_blocks[i], b_blocks[i], rho),
+                                       kwargs={'drop_after': drop_after, 'codec': codec})
+               for i in range(n)]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    try:
+        result = coordinator.run(tol=tol)
+    finally:
+        for w in workers:
+            w.join(1)
+            if w.is_alive():
+                w.terminate()
+    return coordinator, result
@@ -0,0 +1,172 @@
+"""
+Fused kernels for the z-update, the dual ascent and the residual norms.
+
+Written out separately, soft-thresholding, y += rho * (x - z) and the primal and
+dual residual norms each sweep over x, z and y again. The kernels below do all
+of it in one pass and update z and y in place. They are compiled with Numba
+when it is installed and fall back to (in-place) NumPy otherwise.
+"""
+__author__ = 'haohanwang'
+
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None and 'NUMBA_THREADING_LAYER' not in os.environ:
+    # the consensus solvers fork worker processes after running the parallel
+    # kernels, and a process that forked after using the default (TBB or
+    # OpenMP) thread pool deadlocks at exit
+    numba.config.THREADING_LAYER = 'workqueue'
+
+BACKEND = 'numpy' if numba is None else 'numba'
+
+
+def soft_threshold(v, k):
+    return np.sign(v) * np.maximum(np.abs(v) - k, 0)
+
+
+def _z_dual_update_numpy(x, z, y, rho, kappa):
+    z_prev = z.copy()
+    np.divide(y, rho, out=z)
+    z += x
+    shrink = np.abs(z)
+    shrink -= kappa
+    np.maximum(shrink, 0, out=shrink)
+    np.sign(z, out=z)
+    z *= shrink
+    # shrink is reused as the primal residual x - z
+    np.subtract(x, z, out=shrink)
+    r = np.sqrt(np.dot(shrink, shrink))
+    shrink *= rho
+    y += shrink
+    z_prev -= z
+    s = rho * np.sqrt(np.dot(z_prev, z_prev))
+    return r, s
+
+
+def _consensus_update_numpy(x, z, y, rho, kappa, active):
+    n = x.shape[0]
+    z_prev = z.copy()
+    v = x + y / rho
+    np.mean(v, axis=0, out=z)
+    z[:] = soft_threshold(z, kappa)
+    np.subtract(x, z, out=v)
+    r = np.sqrt(np.square(v).sum())
+    v *= rho
+    y[active] += v[active]
+    z_prev -= z
+    s = rho * np.sqrt(n * np.dot(z_prev, z_prev))
+    return r, s
+
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _z_dual_update_numba(x, z, y, rho, kappa):
+        r = 0.
+        s = 0.
+        for j in numba.prange(x.shape[0]):
+            v = x[j] + y[j] / rho
+            a = abs(v) - kappa
+            zj = 0.
+            if a > 0:
+                zj = a if v > 0 else -a
+            d = zj - z[j]
+            s += d * d
+            z[j] = zj
+            d = x[j] - zj
+            y[j] += rho * d
+            r += d * d
+        return np.sqrt(r), rho * np.sqrt(s)
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _consensus_update_numba(x, z, y, rho, kappa, active):
+        n = x.shape[0]
+        r = 0.
+        s = 0.
+        for j in numba.prange(x.shape[1]):
+            v = 0.
+            for i in range(n):
+                v += x[i, j] + y[i, j] / rho
+            v /= n
+            a = abs(v) - kappa
+            zj = 0.
+            if a > 0:
+                zj = a if v > 0 else -a
+            d = zj - z[j]
+            s += d * d
+            z[j] = zj
+            for i in range(n):
+                d = x[i, j] - zj
+                if active[i]:
+                    y[i, j] += rho * d
+                r += d * d
+        return np.sqrt(r), rho * np.sqrt(n * s)
+
+
+def _flat(a, *shape):
+    """a view of a in the given shape, so that updates to it land in a"""
+    if not a.flags.c_contiguous:
+        raise ValueError('the kernels update z and y in place and need C-contiguous arrays')
+    return a.reshape(*shape)
+
+
+def z_dual_update(x, z, y, rho, kappa, backend=None):
+    """
+    z = soft_threshold(x + y / rho, kappa) and y += rho * (x - z), in place;
+    z and y must be C-contiguous.
+
+    :return: the primal residual ||x - z|| and the dual residual
+             rho * ||z - z_prev||
+    """
+    backend = backend or BACKEND
+    x, z, y = x.reshape(-1), _flat(z, -1), _flat(y, -1)
+    if backend == 'numba':
+        return _z_dual_update_numba(x, z, y, float(rho), float(kappa))
+    return _z_dual_update_numpy(x, z, y, rho, kappa)
+
+
+def group_z_dual_update(x, z, y, rho, kappa, group_size):
+    """
+    Group lasso version of z_dual_update over consecutive groups of group_size
+    entries: z_g = max(1 - kappa / ||v_g||, 0) * v_g with v = x + y / rho.
+    NumPy only, the group norms already make it a blocked, vectorized pass.
+    """
+    z_prev = z.copy()
+    v = (x + y / rho).reshape(-1, group_size)
+    norms = np.sqrt(np.square(v).sum(axis=1))
+    scale = 1. - kappa / np.maximum(norms, np.finfo(v.dtype).tiny)
+    np.maximum(scale, 0, out=scale)
+    v *= scale[:, None]
+    z[...] = v.reshape(z.shape)
+    v = x - z
+    r = np.sqrt(np.square(v).sum())
+    v *= rho
+    y += v
+    z_prev -= z
+    s = rho * np.sqrt(np.square(z_prev).sum())
+    return r, s
+
+
+def consensus_update(x, z, y, rho, kappa, active=None, backend=None):
+    """
+    Consensus version for stacked worker variables x, y of shape (n, ...):
+    z = soft_threshold(mean_i(x_i + y_i / rho), kappa) and y_i += rho * (x_i - z)
+    for the workers flagged in active (all of them by default), in place;
+    z and y must be C-contiguous.
+
+    :return: the primal residual sqrt(sum_i ||x_i - z||^2) and the dual
+             residual rho * sqrt(n) * ||z - z_prev||
+    """
+    backend = backend or BACKEND
+    n = x.shape[0]
+    x, z, y = x.reshape(n, -1), _flat(z, -1), _flat(y, n, -1)
+    if active is None:
+        active = np.ones(n, dtype=np.bool_)
+    if backend == 'numba':
+        return _consensus_update_numba(x, z, y, float(rho), float(kappa), active)
+    return _consensus_update_numpy(x, z, y, rho, kappa, active)
@@ -0,0 +1,25 @@
+__author__ = 'haohanwang'
+
+import numpy as np
+from ADMM.ConsensusADMM import AsyncConsensusADMM
+
+n_workers = 4
+X = np.random.randn(2000, 100)
+beta = np.random.random((100, 1))
+beta[np.random.random((100, 1)) < 0.7] = 0
+y = np.dot(X, beta) + 0.01 * np.random.randn(2000, 1)
+lam = 0.01
+rho = 50.
+
+if __name__ == '__main__':
+    A_blocks = np.array_split(X, n_workers)
+    b_blocks = np.array_split(y, n_workers)
+    # the last worker is a straggler; the coordinator proceeds with any 3 of
+    # the 4 shards but never lets one fall more than 4 rounds behind
+    # messages carry 8-bit quantized changes, an eighth of the float64 traffic
+    solver = AsyncConsensusADMM(rho, lam, min_workers=3, tau=4, maxIter=1000, codec='q8')
+    (z, x, u) = solver.run(A_blocks, b_blocks, tol=1e-3, delays=[0, 0, 0, 0.01])
+    print 'distance to the true beta', np.sqrt(np.square(z - beta).sum())
+    for i, st in enumerate(solver.delay_statistics()):
+        print 'worker', i, st
+    print 'bytes moved', solver.bytes_moved()
@@ -0,0 +1,31 @@
+__author__ = 'haohanwang'
+
+import numpy as np
+from ADMM.OnlineADMM import OnlineADMM
+
+p = 100
+batch_size = 50
+n_batches = 2000
+lam = 0.01
+rho = 0.5
+
+beta = np.random.random((p, 1))
+beta[np.random.random((p, 1)) < 0.7] = 0
+
+
+def stream():
+    # minibatches are generated on the fly, the full dataset never exists
+    for i in range(n_batches):
+        X = np.random.randn(batch_size, p)
+        y = np.dot(X, beta) + 0.01 * np.random.randn(batch_size, 1)
+        yield X, y
+
+
+def l_x_grad(b1, X, y):
+    return np.dot(X.T, np.dot(X, b1) - y) / X.shape[0]
+
+
+solver = OnlineADMM(rho, lam, eta=0.5, maxIter=n_batches)
+(x, z, y) = solver.run(stream(), l_x_grad, x=np.zeros((p, 1)))
+print 'distance to the true beta', np.sqrt(np.square(z - beta).sum())
+# print z.T
@@ -0,0 +1,20 @@
+__author__ = 'haohanwang'
+
+import numpy as np
+from ADMM.TCPConsensus import run_localhost
+
+n_workers = 4
+X = np.random.randn(2000, 100)
+beta = np.random.random((100, 1))
+beta[np.random.random((100, 1)) < 0.7] = 0
+y = np.dot(X, beta) + 0.01 * np.random.randn(2000, 1)
+lam = 0.01
+rho = 50.
+
+if __name__ == '__main__':
+    # every worker drops its connection once after 5 rounds and reconnects
+    coordinator, (z, x, u) = run_localhost(np.array_split(X, n_workers), np.array_split(y, n_workers),
+                                           rho, lam, tol=1e-3, drop_after=5, codec='topk+q8')
+    print 'distance to the true beta', np.sqrt(np.square(z - beta).sum())
+    print 'reconnects', coordinator.reconnects
+    print 'bytes moved', coordinator.bytes_moved()
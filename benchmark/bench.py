@@ -0,0 +1,313 @@
+"""
+Benchmark suite for the ADMM solvers.
+
+Runs every problem of a grid (see GRIDS) in a fresh process and records
+time-to-tolerance, iterations, the final primal and dual residuals, peak
+RSS and the peak memory allocated by the solve as JSON; two such files can
+be compared to flag regressions:
+
+    python -m benchmark.bench run --grid small --out new.json
+    python -m benchmark.bench compare base.json new.json --threshold 0.1
+
+Every case is solved once first, neither timed nor traced, so that Numba
+compilation and warm caches count in no measurement. A case converged if
+the solver stopped before maxIter with both (absolute) residuals at most
+residual_tol, since the cost-based stop of ADMM.run also fires when the
+cost goes up.
+
+The allocations are traced with tracemalloc where there is one (Python 3).
+Python 2 has none; there, on Linux, the peak RSS mark is reset before the
+solve and the allocation is its growth above the RSS the solve started
+from. That counts whole pages, and what numpy or BLAS allocate outside
+Python, but not memory the process already held and reuses, so it is a
+lower bound. result['alloc_method'] says which ('tracemalloc', 'rss',
+or None when neither is available and peak_alloc is None), and only
+results measured the same way are compared.
+"""
+__author__ = 'haohanwang'
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import itertools
+import resource
+import multiprocessing
+from Queue import Empty
+
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ADMM.ADMM import ADMM
+from ADMM.ConsensusADMM import AsyncConsensusADMM
+from ADMM import kernels
+from problems import GENERATORS
+
+GRIDS = {
+    'small': {
+        'problem': ['lasso', 'least_squares', 'group_lasso', 'consensus'],
+        'n': [500],
+        'p': [100],
+        'density': [0.1],
+        'cond': [1., 10.],
+    },
+    'full': {
+        'problem': ['lasso', 'least_squares', 'group_lasso', 'consensus'],
+        'n': [500, 2000, 8000],
+        'p': [100, 400, 1000],
+        'density': [0.01, 0.1],
+        'cond': [1., 10., 100.],
+    },
+}
+
+KEY = ('problem', 'n', 'p', 'density', 'cond', 'seed')
+
+# memory growth below this many bytes is noise, not a regression
+MEMORY_SLACK = 1 << 20
+
+
+def cases(grid, seed=0):
+    names = ['problem', 'n', 'p', 'density', 'cond']
+    for values in itertools.product(*[grid[k] for k in names]):
+        case = dict(zip(names, values))
+        case['seed'] = seed
+        yield case
+
+
+def solve(case, problem, tol, maxIter):
+    """
+    Solve one generated problem from scratch.
+
+    :return: (iterations, objective, primal residual, dual residual), the
+             residuals of the last iteration
+    """
+    A, b, lam = problem['A'], problem['b'], problem['lam']
+    p = A.shape[1]
+
+    if case['problem'] == 'consensus':
+        # rho on the scale of the shards' A_i'A_i
+        rho = 0.1 * A.shape[0] / len(problem['A_blocks'])
+        solver = AsyncConsensusADMM(rho, lam, maxIter=maxIter)
+        z = solver.run(problem['A_blocks'], problem['b_blocks'], tol=tol)[0]
+        last = solver.trace[-1]
+        return solver.iterations, objective(A, b, lam, z), last['r'], last['s']
+
+    rho = 1.
+    step_size = 1. / (problem['L'] + rho)
+    group_size = problem.get('group_size')
+
+    def cost(x, z, y):
+        return objective(A, b, lam, z, group_size)
+
+    def l_x_jac(x, z, y):
+        # descent direction of the augmented Lagrangian in x
+        return -(np.dot(A.T, np.dot(A, x) - b) + y + rho * (x - z))
+
+    solver = ADMM(rho, maxIter=maxIter)
+    x, z, y, c = solver.run(cost=cost, l_x=None, l_z=None, const=None,
+                            x=np.zeros((p, 1)), z=np.zeros((p, 1)),
+                            l_x_jac=l_x_jac, l_z_jac=None, tol=tol, step_size=step_size,
+                            lam=lam, group_size=group_size, verbose=False)
+    return solver.iterations, c, solver.r_norm, solver.s_norm
+
+
+def objective(A, b, lam, z, group_size=None):
+    loss = 0.5 * np.square(np.dot(A, z) - b).sum()
+    if group_size is None:
+        return float(loss + lam * np.abs(z).sum())
+    return float(loss + lam * np.sqrt(np.square(z.reshape(-1, group_size)).sum(axis=1)).sum())
+
+
+def _status_kb(field):
+    """a VmRSS / VmHWM line of /proc/self/status in kilobytes, None off Linux"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """reset the VmHWM mark to the current RSS (Linux 4.0 and later)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        return False
+    return _status_kb('VmHWM') is not None
+
+
+def measure(case, tol, maxIter, repeat, residual_tol=1e-2):
+    problem = GENERATORS[case['problem']](case['n'], case['p'], case['density'], case['cond'], case['seed'])
+    problem['L'] = np.linalg.norm(problem['A'], 2) ** 2
+
+    # warm-up: Numba compilation, its cache and numpy's first-use allocations
+    solve(case, problem, tol, maxIter)
+
+    # one warm solve for the allocations, not timed, tracing slows it down
+    peak_alloc = None
+    if tracemalloc is not None:
+        alloc_method = 'tracemalloc'
+        tracemalloc.start()
+        solve(case, problem, tol, maxIter)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    elif _reset_peak_rss():
+        alloc_method = 'rss'
+        rss_before = _status_kb('VmRSS')
+        solve(case, problem, tol, maxIter)
+        peak_alloc = 1024 * (_status_kb('VmHWM') - rss_before)
+    else:
+        alloc_method = None
+
+    times = []
+    for r in range(repeat):
+        start = timeit.default_timer()
+        iterations, obj, r_norm, s_norm = solve(case, problem, tol, maxIter)
+        times.append(timeit.default_timer() - start)
+
+    result = dict(case)
+    result.update({
+        'time': min(times),
+        'iterations': iterations,
+        'objective': obj,
+        'primal_residual': r_norm,
+        'dual_residual': s_norm,
+        'converged': iterations < maxIter and max(r_norm, s_norm) <= residual_tol,
+        # kilobytes on Linux; covers only the coordinator for consensus problems
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        # bytes
+        'peak_alloc': peak_alloc,
+        'alloc_method': alloc_method,
+    })
+    return result
+
+
+def _measure_in_child(case, tol, maxIter, repeat, residual_tol, queue):
+    # the solvers report progress on stdout, which would drown the summary
+    sys.stdout = open(os.devnull, 'w')
+    queue.put(measure(case, tol, maxIter, repeat, residual_tol))
+
+
+def run(grid, tol=1e-6, maxIter=1e4, repeat=3, seed=0, residual_tol=1e-2):
+    """
+    Run every case of the grid in its own process, so that the peak RSS of one
+    case is not inherited by the next. Raises RuntimeError if such a process
+    dies without a result.
+    """
+    results = []
+    for case in cases(grid, seed):
+        queue = multiprocessing.Queue()
+        child = multiprocessing.Process(target=_measure_in_child,
+                                        args=(case, tol, maxIter, repeat, residual_tol, queue))
+        child.start()
+        while True:
+            try:
+                result = queue.get(timeout=1.)
+                break
+            except Empty:
+                if not child.is_alive() and queue.empty():
+                    raise RuntimeError('the process measuring %r died with exit code %s' %
+                                       (case, child.exitcode))
+        child.join()
+        print ('%(problem)s n=%(n)i p=%(p)i density=%(density)g cond=%(cond)g: '
+               '%(time).4fs, %(iterations)i iterations' % result)
+        results.append(result)
+    return {
+        'meta': {
+            'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'kernels': kernels.BACKEND,
+            'machine': platform.machine(),
+            'tol': tol,
+            'residual_tol': residual_tol,
+            'maxIter': int(maxIter),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Compare two result files case by case.
+
+    :return: list of (case, field, old value, new value) for every case that
+             got more than threshold (relative) slower, needed more than
+             threshold more iterations or memory (peak RSS, or peak
+             allocation measured the same way; see MEMORY_SLACK), or
+             stopped converging
+    """
+    old = dict((tuple(r[k] for k in KEY), r) for r in base['results'])
+    regressions = []
+    for r in new['results']:
+        key = tuple(r[k] for k in KEY)
+        if key not in old:
+            continue
+        o = old[key]
+        if r['time'] > o['time'] * (1 + threshold):
+            regressions.append((key, 'time', o['time'], r['time']))
+        if r['iterations'] > o['iterations'] * (1 + threshold):
+            regressions.append((key, 'iterations', o['iterations'], r['iterations']))
+        if _grew(o['peak_rss'], r['peak_rss'], threshold, MEMORY_SLACK // 1024):
+            regressions.append((key, 'peak_rss', o['peak_rss'], r['peak_rss']))
+        if o.get('alloc_method') == r.get('alloc_method') and \
+                _grew(o['peak_alloc'], r['peak_alloc'], threshold, MEMORY_SLACK):
+            regressions.append((key, 'peak_alloc', o['peak_alloc'], r['peak_alloc']))
+        if o['converged'] and not r['converged']:
+            regressions.append((key, 'converged', o['converged'], r['converged']))
+    return regressions
+
+
+def _grew(old, new, threshold, slack):
+    return old is not None and new is not None and new > old * (1 + threshold) and new - old > slack
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ADMM benchmark suite')
+    sub = parser.add_subparsers(dest='command')
+    p_run = sub.add_parser('run')
+    p_run.add_argument('--grid', default='small', choices=sorted(GRIDS))
+    p_run.add_argument('--out', default='bench_results.json')
+    p_run.add_argument('--tol', type=float, default=1e-6)
+    p_run.add_argument('--max-iter', type=float, default=1e4)
+    p_run.add_argument('--repeat', type=int, default=3)
+    p_run.add_argument('--seed', type=int, default=0)
+    p_run.add_argument('--residual-tol', type=float, default=1e-2)
+    p_cmp = sub.add_parser('compare')
+    p_cmp.add_argument('base')
+    p_cmp.add_argument('new')
+    p_cmp.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run(GRIDS[args.grid], args.tol, args.max_iter, args.repeat, args.seed, args.residual_tol)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        return 0
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold)
+    for key, field, o, n in regressions:
+        print 'REGRESSION %s: %s %s -> %s' % (' '.join(str(k) for k in key), field, o, n)
+    if not regressions:
+        print 'no regressions'
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Reproducible synthetic problems for the benchmark suite. Every generator is a
+pure function of its arguments and seed, so two runs of the suite solve
+exactly the same problems.
+"""
+__author__ = 'haohanwang'
+
+import numpy as np
+
+
+def design(n, p, cond, rng):
+    """
+    Gaussian design whose column scales decay geometrically from 1 to
+    1 / cond, which puts the condition number of A'A at roughly cond ** 2.
+    """
+    A = rng.randn(n, p)
+    A *= np.logspace(0, -np.log10(cond), p)
+    return A
+
+
+def lasso(n, p, density=0.1, cond=1., seed=0, lam=0.1):
+    rng = np.random.RandomState(seed)
+    A = design(n, p, cond, rng)
+    beta = rng.randn(p, 1) * (rng.rand(p, 1) < density)
+    b = np.dot(A, beta) + 0.01 * rng.randn(n, 1)
+    return {'A': A, 'b': b, 'beta': beta, 'lam': lam}
+
+
+def least_squares(n, p, density=1., cond=1., seed=0):
+    return lasso(n, p, density, cond, seed, lam=0.)
+
+
+def group_lasso(n, p, density=0.1, cond=1., seed=0, lam=0.1, group_size=5):
+    rng = np.random.RandomState(seed)
+    A = design(n, p, cond, rng)
+    active = rng.rand(p // group_size, 1) < density
+    beta = rng.randn(p, 1) * np.repeat(active, group_size, axis=0)
+    b = np.dot(A, beta) + 0.01 * rng.randn(n, 1)
+    return {'A': A, 'b': b, 'beta': beta, 'lam': lam, 'group_size': group_size}
+
+
+def consensus(n, p, density=0.1, cond=1., seed=0, lam=0.1, n_workers=4):
+    problem = lasso(n, p, density, cond, seed, lam)
+    problem['A_blocks'] = np.array_split(problem['A'], n_workers)
+    problem['b_blocks'] = np.array_split(problem['b'], n_workers)
+    return problem
+
+
+GENERATORS = {
+    'lasso': lasso,
+    'least_squares': least_squares,
+    'group_lasso': group_lasso,
+    'consensus': consensus,
+}
@@ -0,0 +1,345 @@
+"""
+Parallel local solves for the ADMM MLP trainer.
+
+The training set, the stacked worker parameters, the scaled duals and the
+consensus variables all live in shared memory. Every process of the pool
+compiles the local update once and then solves whichever worker subproblems
+it is handed, reading its data shard and writing the worker's parameters in
+place; only the consensus variables and the penalties rho change hands
+between rounds. With no processes the same local solves run one after
+another in the caller. Streamed, the training set stays in its
+memory-mapped files instead.
+"""
+__docformat__ = 'restructedtext en'
+
+import multiprocessing
+import numpy
+
+import theano
+import theano.tensor as T
+from mlp import MLP
+from pipeline import MinibatchStream
+import numpy_mlp
+
+_state = {}
+
+
+def shared_array(shape, dtype):
+    """numpy view on a fresh block of (lock-free) shared memory"""
+    dtype = numpy.dtype(dtype)
+    size = int(numpy.prod(shape))
+    buf = multiprocessing.RawArray('b', max(size * dtype.itemsize, 1))
+    return buf, numpy.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+
+def _as_array(buf, shape, dtype):
+    dtype = numpy.dtype(dtype)
+    return numpy.frombuffer(buf, dtype=dtype, count=int(numpy.prod(shape))).reshape(shape)
+
+
+def worker_shards(n_batches, n_workers, batch_size):
+    """
+    Split the minibatches into n_workers contiguous shards, as (start, stop)
+    rows of the training set, so one worker can own several minibatches.
+    """
+    if not 1 <= n_workers <= n_batches:
+        raise ValueError('need between 1 and %i workers (one minibatch each), got %i' % (n_batches, n_workers))
+    bounds = numpy.cumsum([0] + [len(s) for s in numpy.array_split(numpy.arange(n_batches), n_workers)])
+    return [(int(bounds[i]) * batch_size, int(bounds[i + 1]) * batch_size) for i in xrange(n_workers)]
+
+
+def inner_schedule(shard, inner_steps=None, sub_batch_size=None):
+    """
+    (start, stop) rows of the sub-minibatch used by each inner step of a
+    worker; the steps cycle over the sub-minibatches of the worker's shard,
+    by default exactly once. A sub_batch_size larger than the shard uses the
+    whole shard, never rows of the next one.
+    """
+    start, stop = shard
+    sub = sub_batch_size or (stop - start)
+    n_sub = max((stop - start) // sub, 1)
+    if inner_steps is None:
+        inner_steps = n_sub
+    for k in xrange(inner_steps):
+        first = start + (k % n_sub) * sub
+        yield first, min(first + sub, stop)
+
+
+def shard_stream(data_x, data_y, shard, sub_batch_size, worker, epoch):
+    """
+    MinibatchStream over the rows of a worker's shard, whose shuffling
+    depends only on the worker and the epoch, so that it does not matter
+    which process solves the worker and a resumed run shuffles the same way.
+    """
+    start, stop = shard
+    size = min(sub_batch_size or (stop - start), stop - start)
+    return MinibatchStream(data_x[start:stop], data_y[start:stop], size,
+                           rng=numpy.random.RandomState([1234, worker, epoch]))
+
+
+def stream_schedule(stream, inner_steps=None):
+    """
+    The (x, y) sub-minibatches of each inner step from a shard_stream, one
+    pass over the shard by default; every further pass is shuffled anew.
+    """
+    if inner_steps is None:
+        inner_steps = len(stream)
+    k = 0
+    while k < inner_steps:
+        for batch in stream:
+            yield batch
+            k += 1
+            if k == inner_steps:
+                break
+
+
+def local_solve(step, schedule, inner_tol=None):
+    """
+    Run the local solver of one worker: step(a, b) takes one gradient step on
+    the rows given by an item (a, b) of schedule, the (start, stop) of
+    inner_schedule or the (x, y) of stream_schedule, and returns the cost.
+    Stops early once the cost changes by less than inner_tol (relative)
+    between two steps.
+
+    :return: (last cost, number of steps taken)
+    """
+    prev = None
+    k = 0
+    cost = None
+    for k, (a, b) in enumerate(schedule):
+        cost = step(a, b)
+        if inner_tol is not None and prev is not None and abs(prev - cost) <= inner_tol * abs(prev):
+            break
+        prev = cost
+    return cost, k + 1
+
+
+def per_tensor(value, n_layers):
+    """
+    One value per parameter tensor of an MLP with n_layers layers (hidden
+    layers plus the softmax layer) from a scalar or one value per layer;
+    the W and b of a layer share its value.
+    """
+    if not isinstance(value, (list, tuple)):
+        return [value] * (2 * n_layers)
+    if len(value) != n_layers:
+        raise ValueError('expected one value per layer (%i), got %i' % (n_layers, len(value)))
+    return [v for v in value for k in (0, 1)]
+
+
+def n_layers_of(n_hidden):
+    return len(n_hidden) + 1 if isinstance(n_hidden, (list, tuple)) else 2
+
+
+def compile_local_update(n_in, n_hidden, n_out, L1_reg, L2_reg, backend='theano'):
+    """
+    Gradient of the local ADMM objective of one worker as a pure function
+
+        (x, y, params, z, duals, rhos) -> (cost, gradients)
+
+    so that it can run on any worker's slice of the shared buffers; rhos
+    holds the penalty of every parameter tensor, an input rather than a
+    constant so that it can be adapted between rounds. n_hidden is a width
+    or a list of hidden layer widths. The 'numpy' backend (numpy_mlp) needs
+    no compilation.
+    """
+    n_layers = n_layers_of(n_hidden)
+    if backend == 'numpy':
+        return numpy_mlp.local_update(n_in, n_hidden, n_out, L1_reg, L2_reg)
+    x = T.matrix('x')
+    y = T.ivector('y')
+
+    def tensors(prefix):
+        return [f('%s%s%i' % (prefix, name, k)) for k in xrange(n_layers)
+                for f, name in ((T.matrix, 'W'), (T.vector, 'b'))]
+
+    params = tensors('')
+    z = tensors('z_')
+    duals = tensors('u_')
+    rhos = [T.scalar('rho_' + param.name) for param in params]
+    classifier = MLP(
+        rng=None,
+        input=x,
+        n_in=n_in,
+        n_hidden=n_hidden,
+        n_out=n_out,
+        params=params
+    )
+    cost = (classifier.negative_log_likelihood(y)
+            + L1_reg * classifier.L1
+            + L2_reg * classifier.L2_sqr
+            + 0.5 * classifier.augment(z, duals, rhos))
+    gparams = [T.grad(cost, param) for param in params]
+    return theano.function(
+        inputs=[x, y] + params + z + duals + rhos,
+        outputs=[cost] + gparams
+    )
+
+
+def gossip_mix(w_params, w_duals, targets, neighbours, i):
+    """
+    The neighbour mix of decentralized ADMM (see mlp_admm.gossip_update) for
+    worker i alone, in place: reads only the parameters of i and of its
+    neighbours and writes only the dual and the target of i, so all workers
+    can mix at once as long as nobody changes parameters meanwhile.
+    """
+    for w, u, t in zip(w_params, w_duals, targets):
+        w[neighbours[i]].mean(axis=0, dtype=t.dtype, out=t[i])
+        u[i] += 0.5 * (w[i] - t[i])
+        t[i] += w[i]
+        t[i] *= 0.5
+
+
+def _init_process(layout, spec, solver, files):
+    _state['arrays'] = dict((name, _as_array(buf, shape, dtype)) for name, (buf, shape, dtype) in layout.items())
+    for name, path in files.items():
+        _state['arrays'][name] = numpy.load(path, mmap_mode='r')
+    _state['solver'] = solver
+    _state['grad'] = compile_local_update(**spec)
+
+
+def _local_update(job):
+    i, epoch = job
+    a = _state['arrays']
+    solver = _state['solver']
+    n_params = len([k for k in a if k.startswith('param')])
+    params = [a['param%i' % k][i] for k in range(n_params)]
+    duals = [a['dual%i' % k][i] for k in range(n_params)]
+    if solver['local_z']:
+        z = [a['z%i' % k][i] for k in range(n_params)]
+    else:
+        z = [a['z%i' % k] for k in range(n_params)]
+    if solver['momentum']:
+        velocities = [a['vel%i' % k][i] for k in range(n_params)]
+    lr = solver['learning_rate']
+    # the trainer may have adapted rho since the last round
+    rhos = [float(r) for r in a['rho']]
+
+    def step(x, y):
+        outs = _state['grad'](x, y, *(params + z + duals + rhos))
+        for k, g in enumerate(outs[1:]):
+            # the gradient is not needed afterwards, scaling it in place saves
+            # a temporary per tensor
+            g *= lr
+            if solver['momentum']:
+                velocities[k] *= solver['momentum']
+                velocities[k] -= g
+                params[k] += velocities[k]
+            else:
+                params[k] -= g
+        return float(outs[0])
+
+    if solver['stream']:
+        schedule = stream_schedule(shard_stream(a['x'], a['y'], solver['shards'][i], solver['sub_batch_size'],
+                                                i, epoch),
+                                   solver['inner_steps'])
+    else:
+        schedule = ((a['x'][start:stop], a['y'][start:stop])
+                    for start, stop in inner_schedule(solver['shards'][i], solver['inner_steps'],
+                                                      solver['sub_batch_size']))
+    return local_solve(step, schedule, solver['inner_tol'])
+
+
+def _local_mix(job):
+    i, tensors = job
+    a = _state['arrays']
+    gossip_mix([a['param%i' % k] for k in tensors], [a['dual%i' % k] for k in tensors],
+               [a['z%i' % k] for k in tensors], _state['solver']['neighbours'], i)
+
+
+class WorkerPool(object):
+    """
+    Process pool running the local subproblems of the ADMM workers in
+    parallel (or, with n_procs=0, in this process). After run_round, params
+    and duals hold the stacked worker parameters and duals and z the
+    consensus variables, all as numpy views on the shared memory the pool
+    processes work on, as are the momentum velocities of the workers. Given
+    the (n_workers, degree) neighbours of a topology, z is stacked too and
+    every worker solves against its own consensus target, as in
+    decentralized ADMM, which mix_round updates from the neighbours'
+    parameters. rho holds the penalty of every parameter tensor, read by the
+    workers at the start of each local solve.
+
+    With stream, train_x and train_y must be memory-mapped .npy files (see
+    logistic_sgd.cached_splits), which every process maps instead of the
+    training set being copied into shared memory, and the workers take
+    their inner steps on shuffled sub-minibatches of their shards (see
+    shard_stream).
+    """
+
+    def __init__(self, n_procs, train_x, train_y, shards, init_params,
+                 n_in, n_hidden, n_out, learning_rate, L1_reg, L2_reg, rho,
+                 inner_steps=None, inner_tol=None, sub_batch_size=None, momentum=0., dual_dtype=None,
+                 backend='theano', neighbours=None, stream=False):
+        layout = {}
+        arrays = {}
+        files = {}
+
+        def allocate(name, value):
+            buf, arr = shared_array(value.shape, value.dtype)
+            arr[...] = value
+            layout[name] = (buf, value.shape, value.dtype.str)
+            arrays[name] = arr
+
+        if stream:
+            files['x'] = train_x.filename
+            files['y'] = train_y.filename
+        else:
+            allocate('x', train_x)
+            allocate('y', numpy.asarray(train_y, dtype='int32'))
+        for k, value in enumerate(init_params):
+            allocate('param%i' % k, value)
+            allocate('dual%i' % k, numpy.zeros_like(value, dtype=dual_dtype))
+            allocate('z%i' % k, numpy.zeros_like(value if neighbours is not None else value[0]))
+            if momentum:
+                allocate('vel%i' % k, numpy.zeros_like(value))
+
+        self.n_workers = init_params[0].shape[0]
+        self.params = [arrays['param%i' % k] for k in range(len(init_params))]
+        self.duals = [arrays['dual%i' % k] for k in range(len(init_params))]
+        allocate('rho', numpy.asarray(per_tensor(rho, n_layers_of(n_hidden)), dtype='float64'))
+        self.z = [arrays['z%i' % k] for k in range(len(init_params))]
+        self.rho = arrays['rho']
+        self.velocities = [arrays['vel%i' % k] for k in range(len(init_params))] if momentum else []
+        spec = dict(n_in=n_in, n_hidden=n_hidden, n_out=n_out, L1_reg=L1_reg, L2_reg=L2_reg,
+                    backend=backend)
+        solver = dict(learning_rate=learning_rate, shards=shards, inner_steps=inner_steps,
+                      inner_tol=inner_tol, sub_batch_size=sub_batch_size, momentum=momentum,
+                      local_z=neighbours is not None, neighbours=neighbours, stream=stream)
+        if n_procs > 0:
+            self.pool = multiprocessing.Pool(n_procs, initializer=_init_process,
+                                             initargs=(layout, spec, solver, files))
+        else:
+            self.pool = None
+            _init_process(layout, spec, solver, files)
+
+    def run_round(self, workers=None, epoch=0):
+        """
+        solve the local subproblems of the given workers (all by default),
+        return their (last cost, inner steps taken); with stream, the epoch
+        seeds the shuffling of the shards
+        """
+        if workers is None:
+            workers = range(self.n_workers)
+        jobs = [(i, epoch) for i in workers]
+        if self.pool is None:
+            return map(_local_update, jobs)
+        return self.pool.map(_local_update, jobs)
+
+    def mix_round(self, tensors=None):
+        """
+        mix every worker with its neighbours (see gossip_mix) in the given
+        parameter tensors (all by default), each in the process that gets it
+        """
+        if tensors is None:
+            tensors = range(len(self.params))
+        jobs = [(i, list(tensors)) for i in xrange(self.n_workers)]
+        if self.pool is None:
+            map(_local_mix, jobs)
+        else:
+            self.pool.map(_local_mix, jobs)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
@@ -0,0 +1,104 @@
+"""
+Checkpoints of training runs, for resuming them exactly.
+
+A checkpoint is a directory holding one uncompressed ``.npy`` file per
+array (model parameters, and for ADMM the stacked worker parameters, duals,
+consensus variables and penalties) and ``state.pkl`` with the small state:
+epoch, early-stopping counters and the states of the random generators.
+Saving is one sequential write per array, no conversion and no compression,
+and loading memory-maps the arrays, so only what is copied back into the
+live buffers is read.
+
+Every checkpoint is written to a fresh directory ``ckpt-<epoch>-<random>``
+under the checkpoint directory and then published by atomically replacing
+the small file LATEST that names it; a crash while writing leaves the
+previous checkpoint in place. Once the new one is published, the older
+checkpoints are removed; nothing else in the checkpoint directory is
+touched.
+"""
+__docformat__ = 'restructedtext en'
+
+import cPickle
+import os
+import re
+import shutil
+import tempfile
+
+import numpy
+
+LATEST = 'LATEST'
+# the directories save_checkpoint creates
+_CHECKPOINT = re.compile(r'^ckpt-\d{8}-')
+
+
+def arrays_of(params):
+    """the arrays of a list of shared variables or arrays"""
+    return [p.get_value(borrow=True) if hasattr(p, 'get_value') else p for p in params]
+
+
+def restore(params, arrays):
+    """copy arrays into a list of shared variables or arrays, in place"""
+    for p, a in zip(params, arrays):
+        if hasattr(p, 'get_value'):
+            p.set_value(numpy.array(a, dtype=p.get_value(borrow=True).dtype), borrow=True)
+        else:
+            p[...] = a
+
+
+def _fsync_write(path, write):
+    with open(path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def save_checkpoint(directory, arrays, state):
+    """
+    :type arrays: dict
+    :param arrays: name -> numpy.ndarray, written as ``<name>.npy``
+
+    :type state: dict
+    :param state: anything picklable, e.g. counters and RandomState states;
+                  state['epoch'] names the checkpoint
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = tempfile.mkdtemp(prefix='ckpt-%08i-' % state['epoch'], dir=directory)
+    name = os.path.basename(path)
+    for key, value in arrays.items():
+        _fsync_write(os.path.join(path, key + '.npy'), lambda f: numpy.save(f, value))
+    _fsync_write(os.path.join(path, 'state.pkl'),
+                 lambda f: cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL))
+    tmp_latest = os.path.join(directory, LATEST + '.tmp')
+    _fsync_write(tmp_latest, lambda f: f.write(name))
+    os.rename(tmp_latest, os.path.join(directory, LATEST))
+    # the rename only survives a crash once the directory entry is on disk
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    # older checkpoints, and whatever an interrupted save left behind
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry != name and _CHECKPOINT.match(entry) and os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def load_checkpoint(directory, mmap=True):
+    """
+    (arrays, state) of the latest checkpoint in directory, the arrays
+    memory-mapped read-only with mmap; None if there is none
+    """
+    latest = os.path.join(directory, LATEST)
+    if not os.path.isfile(latest):
+        return None
+    with open(latest, 'rb') as f:
+        path = os.path.join(directory, f.read().strip())
+    arrays = {}
+    for entry in os.listdir(path):
+        if entry.endswith('.npy'):
+            arrays[entry[:-4]] = numpy.load(os.path.join(path, entry), mmap_mode='r' if mmap else None)
+    with open(os.path.join(path, 'state.pkl'), 'rb') as f:
+        state = cPickle.load(f)
+    return arrays, state
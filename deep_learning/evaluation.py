@@ -0,0 +1,185 @@
+"""
+Evaluation of a classifier on a whole data split.
+
+Instead of one compiled call per minibatch (which drops the samples after
+the last full minibatch), the split is scored in as few calls as possible:
+one, or a few chunks of at most chunk_size rows to cap memory. The error
+rate is the number of mistakes over the true number of samples.
+
+AsyncEvaluator moves this scoring off the training loop: it is handed a
+copy of the parameters after each epoch and scores it in a separate
+process, so training never waits for validation or test. When scoring
+takes longer than an epoch, snapshots that could not be scored in time are
+skipped in favour of the newest one.
+"""
+__docformat__ = 'restructedtext en'
+
+import multiprocessing
+import traceback
+from Queue import Empty
+
+import theano
+import theano.tensor as T
+
+
+class SplitEvaluator(object):
+    """Zero-one loss of a classifier over a whole (shared) data split"""
+
+    def __init__(self, classifier, x, y, set_x, set_y, chunk_size=10000):
+        """
+        :type classifier: LogisticRegression or MLP
+        :param classifier: model whose ``errors`` is evaluated
+
+        :type x: theano.tensor.TensorType
+        :param x: symbolic input the classifier was built on
+
+        :type y: theano.tensor.TensorType
+        :param y: symbolic labels
+
+        :type set_x: theano.tensor.TensorType
+        :param set_x: shared inputs of the split
+
+        :type set_y: theano.tensor.TensorType
+        :param set_y: (cast) shared labels of the split
+
+        :type chunk_size: int
+        :param chunk_size: largest number of rows scored by one call
+        """
+        self.n = set_x.get_value(borrow=True).shape[0]
+        self.chunk_size = min(chunk_size or self.n, self.n)
+        start = T.lscalar('start')
+        stop = T.lscalar('stop')
+        # errors() is a mean, scaling by the chunk length gives the count
+        self.count_errors = theano.function(
+            inputs=[start, stop],
+            outputs=classifier.errors(y) * y.shape[0],
+            givens={
+                x: set_x[start:stop],
+                y: set_y[start:stop]
+            }
+        )
+
+    def error_count(self):
+        return sum(int(round(self.count_errors(start, min(start + self.chunk_size, self.n))))
+                   for start in xrange(0, self.n, self.chunk_size))
+
+    def __call__(self):
+        """error rate over every sample of the split"""
+        return self.error_count() / float(self.n)
+
+
+def _evaluate_snapshots(classifier, x, y, valid_set, test_set, snapshots, results):
+    try:
+        validate_model = SplitEvaluator(classifier, x, y, *valid_set)
+        test_model = SplitEvaluator(classifier, x, y, *test_set)
+        best_validation_loss = float('inf')
+        while True:
+            msg = snapshots.get()
+            if msg is None:
+                break
+            tag, values = msg
+            # the classifier of this process is a copy of the trainer's, so
+            # its parameters can be overwritten freely
+            for param, value in zip(classifier.params, values):
+                param.set_value(value, borrow=True)
+            this_validation_loss = validate_model()
+            test_score = None
+            if this_validation_loss < best_validation_loss:
+                best_validation_loss = this_validation_loss
+                test_score = test_model()
+            results.put((tag, this_validation_loss, test_score))
+    except Exception:
+        results.put(('error', traceback.format_exc(), None))
+
+
+class AsyncEvaluator(object):
+    """
+    Scores parameter snapshots on the validation set in a background process.
+
+    The process is forked from the trainer once the model is built and
+    evaluates its own copy of the classifier, so the trainer only pays for
+    copying the parameters. Whenever a snapshot beats every validation
+    score seen before, the test set is scored too. Results come back in
+    submission order through results(), usually one epoch after submit().
+    A snapshot that is superseded while waiting for the process has no
+    result.
+    """
+
+    def __init__(self, classifier, x, y, valid_set, test_set, max_pending=1):
+        """
+        :type classifier: LogisticRegression or MLP
+        :param classifier: model whose shared ``params`` get the snapshots
+
+        :type valid_set: tuple
+        :param valid_set: (shared inputs, cast shared labels) of the
+                          validation set
+
+        :type test_set: tuple
+        :param test_set: (shared inputs, cast shared labels) of the test set
+
+        :type max_pending: int
+        :param max_pending: snapshots handed to the process and not scored
+                            yet; beyond that a new snapshot waits in the
+                            trainer, replacing any older one waiting there
+        """
+        self.max_pending = max_pending
+        self.pending = 0
+        self.ready = []
+        # the newest snapshot not handed to the process yet
+        self.waiting = None
+        self.snapshots = multiprocessing.Queue()
+        self.results_queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=_evaluate_snapshots,
+            args=(classifier, x, y, valid_set, test_set, self.snapshots, self.results_queue)
+        )
+        self.process.daemon = True
+        self.process.start()
+
+    def _get(self, block):
+        result = self.results_queue.get(block)
+        if result[0] == 'error':
+            raise RuntimeError('background evaluation failed:\n' + result[1])
+        self.pending -= 1
+        return result
+
+    def _poll(self):
+        """move whatever the process has scored to ready, and refill it"""
+        while self.pending:
+            try:
+                self.ready.append(self._get(False))
+            except Empty:
+                break
+        if self.waiting is not None and self.pending < self.max_pending:
+            self.snapshots.put(self.waiting)
+            self.waiting = None
+            self.pending += 1
+
+    def submit(self, tag, params):
+        """
+        queue a copy of params (shared variables or arrays) for evaluation,
+        tag is handed back with the result; never waits for the process
+        """
+        self.waiting = (tag, [p.get_value() if hasattr(p, 'get_value') else p.copy() for p in params])
+        self._poll()
+
+    def results(self, wait=False):
+        """
+        (tag, validation loss, test score or None) of every evaluated
+        snapshot, oldest first; with wait, also of the ones still pending
+        """
+        while True:
+            self._poll()
+            while self.ready:
+                yield self.ready.pop(0)
+            if not wait or not self.pending:
+                return
+            self.ready.append(self._get(True))
+
+    def close(self):
+        self.waiting = None
+        self.snapshots.put(None)
+        # unread results would keep the process from exiting
+        for result in self.results(wait=True):
+            pass
+        self.process.join()
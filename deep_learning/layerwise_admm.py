@@ -0,0 +1,284 @@
+"""
+Gradient-free training of an MLP by ADMM over its layers.
+
+Instead of backpropagation, the network is split at every layer by
+introducing the pre-activations Z_l and activations A_l of the training set
+as variables, tied together by the constraints
+
+    Z_l = [A_{l-1}, 1] W_l,    A_l = tanh(Z_l)
+
+(A_0 being the inputs, W_l holding the weights and, as last row, the biases
+of layer l). Following Taylor et al., "Training Neural Networks Without
+Gradients: A Scalable ADMM Approach" (ICML 2016), the activation constraints
+are relaxed into quadratic penalties of weight gamma, the pre-activation
+constraints into penalties of weight beta, and only the output layer keeps
+a Lagrange multiplier. Every iteration then solves for each block in closed
+form, input layer first:
+
+    W_l   least squares of Z_l (shifted by the multiplier for the output
+          layer) on [A_{l-1}, 1]; the Gram matrix of the inputs never
+          changes, so its inverse is computed once
+    A_l   least squares balancing the next layer's fit against tanh(Z_l),
+          a (d_l x d_l) solve shared by all rows
+    Z_l   elementwise, a few vectorized Newton steps on
+          gamma (A_l - tanh(z)) ** 2 + beta (z - M_l) ** 2
+
+and for the output layer Z_L minimizes a squared loss to the one-hot
+labels plus the multiplier and penalty terms, again elementwise. Each step
+is one large matrix product or solve over the whole training set, which
+BLAS spreads over all cores; nothing is differentiated. The 'jacobi'
+schedule of iterate instead solves every block from the previous sweep,
+so that the layers no longer wait for each other.
+
+The trained weights are an ordinary MLP (tanh hidden layers, softmax on the
+last pre-activations), so they can be saved with model_io and scored by
+numpy_mlp or BatchPredictor.
+"""
+__docformat__ = 'restructedtext en'
+
+import os
+import sys
+import timeit
+
+import numpy
+
+import theano
+
+from logistic_sgd import cached_splits, dataset_path, set_precision
+from model_io import save_params
+import numpy_mlp
+
+
+def with_ones(A):
+    """[A, 1], the activations with a constant column for the biases"""
+    return numpy.hstack([A, numpy.ones((A.shape[0], 1), dtype=A.dtype)])
+
+
+class LayerwiseADMM(object):
+    """
+    Layer-wise ADMM trainer of an MLP with tanh hidden layers on a fixed
+    (full) training batch
+    """
+
+    def __init__(self, rng, x, y, n_hidden, n_out, beta=10., gamma=10., ridge=1e-3,
+                 newton_steps=3, dtype=None):
+        """
+        :type rng: numpy.random.RandomState
+        :param rng: a random number generator used to initialize weights
+
+        :type x: numpy.ndarray
+        :param x: training inputs, one example per row
+
+        :type y: numpy.ndarray
+        :param y: integer training labels
+
+        :type n_hidden: int or list of int
+        :param n_hidden: width(s) of the hidden layers
+
+        :type beta: float
+        :param beta: weight of the pre-activation constraints Z_l = [A, 1] W_l
+
+        :type gamma: float
+        :param gamma: weight of the activation constraints A_l = tanh(Z_l)
+
+        :type ridge: float
+        :param ridge: Tikhonov term keeping the least-squares solves well posed
+
+        :type newton_steps: int
+        :param newton_steps: Newton steps of the elementwise Z_l subproblems
+
+        :type dtype: string
+        :param dtype: type of the data and the parameters, theano.config.floatX
+                      by default (see logistic_sgd.set_precision)
+        """
+        dtype = dtype or theano.config.floatX
+        if not isinstance(n_hidden, (list, tuple)):
+            n_hidden = [n_hidden]
+        self.beta = beta
+        self.gamma = gamma
+        self.ridge = ridge
+        self.newton_steps = newton_steps
+        self.n_layers = len(n_hidden) + 1
+
+        x = numpy.asarray(x, dtype=dtype)
+        self.x = with_ones(x)
+        self.targets = numpy.zeros((x.shape[0], n_out), dtype=dtype)
+        self.targets[numpy.arange(x.shape[0]), numpy.asarray(y, dtype='int64')] = 1
+
+        # start from the forward pass of an MLP initialized the usual way
+        model = numpy_mlp.MLP(rng, x.shape[1], n_hidden, n_out, dtype=dtype)
+        self.W = [numpy.vstack([W, b[None, :]]) for W, b in zip(model.params[0::2], model.params[1::2])]
+        self.Z = []
+        self.A = []
+        a = self.x
+        for l in xrange(self.n_layers):
+            self.Z.append(numpy.dot(a, self.W[l]))
+            if l < self.n_layers - 1:
+                self.A.append(numpy.tanh(self.Z[l]))
+                a = with_ones(self.A[l])
+        self.multiplier = numpy.zeros_like(self.Z[-1])
+
+        # the inputs never change: factor their Gram matrix once
+        gram = numpy.dot(self.x.T, self.x)
+        gram[numpy.diag_indices_from(gram)] += ridge
+        self.input_solver = numpy.linalg.inv(gram).astype(dtype)
+
+    def inputs(self, l):
+        """[A_{l-1}, 1], the input of layer l"""
+        return self.x if l == 0 else with_ones(self.A[l - 1])
+
+    def target(self, l):
+        """
+        what [A_{l-1}, 1] W_l is fitted to: Z_l, shifted by the scaled
+        multiplier for the output layer, whose constraint term is
+        beta ||Z - M||^2 + <multiplier, Z - M>
+        """
+        if l < self.n_layers - 1:
+            return self.Z[l]
+        return self.Z[l] + self.multiplier / (2 * self.beta)
+
+    def solve_weights(self, l):
+        """the W_l fitting target(l) on the current input of layer l"""
+        a = self.inputs(l)
+        if l == 0:
+            return numpy.dot(self.input_solver, numpy.dot(a.T, self.target(l)))
+        gram = numpy.dot(a.T, a)
+        gram[numpy.diag_indices_from(gram)] += self.ridge
+        return numpy.linalg.solve(gram, numpy.dot(a.T, self.target(l)))
+
+    def solve_activations(self, l):
+        # min beta ||target_{l+1} - A W - b||^2 + gamma ||A - tanh(Z_l)||^2
+        # over A
+        W, b = self.W[l + 1][:-1], self.W[l + 1][-1]
+        lhs = self.beta * numpy.dot(W, W.T)
+        lhs[numpy.diag_indices_from(lhs)] += self.gamma
+        rhs = self.beta * numpy.dot(self.target(l + 1) - b, W.T)
+        rhs += self.gamma * numpy.tanh(self.Z[l])
+        return numpy.linalg.solve(lhs, rhs.T).T
+
+    def solve_preactivations(self, l):
+        # elementwise min gamma (a - tanh(z))^2 + beta (z - m)^2, by
+        # Gauss-Newton steps from the current value
+        m = numpy.dot(self.inputs(l), self.W[l])
+        a = self.A[l]
+        z = self.Z[l].copy()
+        for k in xrange(self.newton_steps):
+            h = numpy.tanh(z)
+            dh = 1 - h ** 2
+            grad = self.gamma * (h - a) * dh + self.beta * (z - m)
+            z -= grad / (self.gamma * dh ** 2 + self.beta)
+        return z
+
+    def solve_output(self):
+        # elementwise min ||z - t||^2 + multiplier z + beta (z - m)^2
+        m = numpy.dot(self.inputs(self.n_layers - 1), self.W[-1])
+        return (2 * self.targets - self.multiplier + 2 * self.beta * m) / (2 + 2 * self.beta)
+
+    def iterate(self, update_multiplier=True, schedule='gauss-seidel', damping=0.5):
+        """
+        One sweep over all blocks, then ascent on the multiplier of
+        Z_L = [A_{L-1}, 1] W_L; returns the RMS of that residual.
+
+        The 'gauss-seidel' schedule updates the blocks input layer first,
+        each from the newest values of the others. Under 'jacobi' every block
+        is solved from the values of the previous sweep, so the solves of all
+        layers are independent of each other and can be dispatched at once;
+        each block then only moves damping of the way to its solution, as
+        the undamped sweeps diverge.
+        """
+        hidden = xrange(self.n_layers - 1)
+        if schedule == 'gauss-seidel':
+            for l in hidden:
+                self.W[l] = self.solve_weights(l)
+                self.A[l] = self.solve_activations(l)
+                self.Z[l] = self.solve_preactivations(l)
+            self.W[-1] = self.solve_weights(self.n_layers - 1)
+            self.Z[-1] = self.solve_output()
+        elif schedule == 'jacobi':
+            W = [self.solve_weights(l) for l in xrange(self.n_layers)]
+            A = [self.solve_activations(l) for l in hidden]
+            Z = [self.solve_preactivations(l) for l in hidden] + [self.solve_output()]
+            for blocks, new in ((self.W, W), (self.A, A), (self.Z, Z)):
+                for old, block in zip(blocks, new):
+                    old += damping * (block - old)
+        else:
+            raise ValueError("unknown schedule %r, expected 'gauss-seidel' or 'jacobi'" % schedule)
+        residual = self.Z[-1] - numpy.dot(self.inputs(self.n_layers - 1), self.W[-1])
+        if update_multiplier:
+            self.multiplier += self.beta * residual
+        return numpy.sqrt((residual ** 2).mean())
+
+    def params(self):
+        """the weights as [W, b] pairs in the order of MLP.params"""
+        return [p for W in self.W for p in (W[:-1], W[-1])]
+
+
+def test_layerwise_admm(n_iter=100, warm_start=10, dataset='mnist.pkl.gz', n_hidden=300,
+                        beta=10., gamma=10., n_train=None, save_to='layerwise_admm.npz',
+                        precision='float32', schedule='gauss-seidel'):
+    """
+    Train an MLP on MNIST with LayerwiseADMM on the full training set.
+
+    :type n_iter: int
+    :param n_iter: number of ADMM sweeps
+
+    :type warm_start: int
+    :param warm_start: initial sweeps without multiplier updates
+
+    :type n_train: int
+    :param n_train: optional, train on the first n_train examples only
+
+    :type save_to: string
+    :param save_to: where the weights of the best model on the validation
+                    set are written (see model_io)
+
+    :type precision: string
+    :param precision: floating point type of the data and the model (see
+                      logistic_sgd.set_precision)
+
+    :type schedule: string
+    :param schedule: 'gauss-seidel' or 'jacobi' (see LayerwiseADMM.iterate)
+    """
+    set_precision(precision)
+    (train_x, train_y), (valid_x, valid_y), (test_x, test_y) = cached_splits(dataset_path(dataset))
+    if n_train is not None:
+        train_x, train_y = train_x[:n_train], train_y[:n_train]
+    n_out = 10
+
+    print '... building the model'
+    rng = numpy.random.RandomState(1234)
+    trainer = LayerwiseADMM(rng, train_x, train_y, n_hidden, n_out, beta=beta, gamma=gamma)
+
+    def error(x, y, params):
+        model = numpy_mlp.MLP(None, x.shape[1], n_hidden, n_out, params=params)
+        model.forward(x)
+        return model.errors(numpy.asarray(y, dtype='int64'))
+
+    print '... training'
+    best_validation_loss = numpy.inf
+    test_score = 0.
+    start_time = timeit.default_timer()
+    for it in xrange(n_iter):
+        residual = trainer.iterate(update_multiplier=it >= warm_start, schedule=schedule)
+        params = trainer.params()
+        this_validation_loss = error(valid_x, valid_y, params)
+        print('iteration %i, residual %f, validation error %f %%' %
+              (it + 1, residual, this_validation_loss * 100.))
+        if this_validation_loss < best_validation_loss:
+            best_validation_loss = this_validation_loss
+            test_score = error(test_x, test_y, params)
+            save_params(save_to, params)
+            print('     iteration %i, test error of best model %f %%' %
+                  (it + 1, test_score * 100.))
+
+    end_time = timeit.default_timer()
+    print(('Optimization complete. Best validation score of %f %% '
+           'with test performance %f %%') %
+          (best_validation_loss * 100., test_score * 100.))
+    print >> sys.stderr, ('The code for file ' +
+                          os.path.split(__file__)[1] +
+                          ' ran for %.2fm' % ((end_time - start_time) / 60.))
+
+
+if __name__ == '__main__':
+    test_layerwise_admm()
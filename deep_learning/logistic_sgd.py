@@ -36,8 +36,11 @@ __docformat__ = 'restructedtext en'
 
 import cPickle
 import gzip
+import hashlib
 import os
+import shutil
 import sys
+import tempfile
 import timeit
 
 import numpy
@@ -45,6 +48,17 @@ import numpy
 import theano
 import theano.tensor as T
 
+from model_io import save_model, BatchPredictor
+
+
+def set_precision(precision):
+    """
+    Make everything built from now on compute in precision, 'float32' or
+    'float64': datasets, model parameters, symbolic inputs and the trainers'
+    buffers all follow theano.config.floatX
+    """
+    theano.config.floatX = precision
+
 
 class LogisticRegression(object):
     """Multi-class Logistic Regression Class
@@ -173,17 +187,63 @@ class LogisticRegression(object):
             raise NotImplementedError()
 
 
-def load_data(dataset):
-    ''' Loads the dataset
+SPLITS = ('train', 'valid', 'test')
 
-    :type dataset: string
-    :param dataset: the path to the dataset (here MNIST)
-    '''
 
-    #############
-    # LOAD DATA #
-    #############
+def file_hash(path, block_size=1 << 20):
+    """sha1 of a file, read in blocks"""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
 
+
+def cached_splits(dataset):
+    """
+    The (input, target) numpy arrays of the train, valid and test splits of
+    a pickled dataset, through a cache of uncompressed ``.npy`` files.
+
+    The first call unpickles the dataset once, converts every array to
+    ``floatX`` and writes it next to the dataset under a directory named
+    after the sha1 of the source file and floatX, so that a changed source
+    or precision never hits a stale cache. Later calls memory-map these
+    files read-only: no decompression, no conversion and no copy, the OS
+    pages the data in as it is touched.
+    """
+    cache_dir = os.path.join(
+        dataset + '.cache',
+        '%s-%s' % (file_hash(dataset), theano.config.floatX)
+    )
+    if not os.path.isdir(cache_dir):
+        f = gzip.open(dataset, 'rb')
+        splits = cPickle.load(f)
+        f.close()
+        # written to a scratch directory first and renamed into place, so
+        # that an interrupted conversion leaves no half-written cache behind
+        parent = os.path.dirname(cache_dir)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        for name, (data_x, data_y) in zip(SPLITS, splits):
+            for suffix, data in (('x', data_x), ('y', data_y)):
+                numpy.save(os.path.join(tmp_dir, '%s_%s.npy' % (name, suffix)),
+                           numpy.ascontiguousarray(data, dtype=theano.config.floatX))
+        try:
+            os.rename(tmp_dir, cache_dir)
+        except OSError:
+            # another process finished the same conversion first
+            shutil.rmtree(tmp_dir)
+    return [tuple(numpy.load(os.path.join(cache_dir, '%s_%s.npy' % (name, suffix)), mmap_mode='r')
+                  for suffix in ('x', 'y'))
+            for name in SPLITS]
+
+
+def dataset_path(dataset):
+    """
+    Resolve the path of a dataset, looking into the data directory of the
+    repository for bare file names and downloading MNIST if it is missing
+    """
     # Download the MNIST dataset if it is not present
     data_dir, data_file = os.path.split(dataset)
     if data_dir == "" and not os.path.isfile(dataset):
@@ -205,12 +265,35 @@ def load_data(dataset):
         print 'Downloading data from %s' % origin
         urllib.urlretrieve(origin, dataset)
 
+    return dataset
+
+
+def load_data(dataset, cache=True):
+    ''' Loads the dataset
+
+    :type dataset: string
+    :param dataset: the path to the dataset (here MNIST)
+
+    :type cache: bool
+    :param cache: read the dataset through the memory-mapped ``.npy`` cache
+                  of cached_splits instead of unpickling it on every call
+    '''
+
+    #############
+    # LOAD DATA #
+    #############
+
+    dataset = dataset_path(dataset)
+
     print '... loading data'
 
     # Load the dataset
-    f = gzip.open(dataset, 'rb')
-    train_set, valid_set, test_set = cPickle.load(f)
-    f.close()
+    if cache:
+        train_set, valid_set, test_set = cached_splits(dataset)
+    else:
+        f = gzip.open(dataset, 'rb')
+        train_set, valid_set, test_set = cPickle.load(f)
+        f.close()
     #train_set, valid_set, test_set format: tuple(input, target)
     #input is an numpy.ndarray of 2 dimensions (a matrix)
     #witch row's correspond to an example. target is a
@@ -254,7 +337,7 @@ def load_data(dataset):
 
 def sgd_optimization_mnist(learning_rate=0.13, n_epochs=1000,
                            dataset='mnist.pkl.gz',
-                           batch_size=600):
+                           batch_size=600, precision='float32'):
     """
     Demonstrate stochastic gradient descent optimization of a log-linear
     model
@@ -272,7 +355,12 @@ def sgd_optimization_mnist(learning_rate=0.13, n_epochs=1000,
     :param dataset: the path of the MNIST dataset file from
                  http://www.iro.umontreal.ca/~lisa/deep/data/mnist/mnist.pkl.gz
 
+    :type precision: string
+    :param precision: floating point type of the data and the model (see
+                      set_precision)
+
     """
+    set_precision(precision)
     datasets = load_data(dataset)
 
     train_set_x, train_set_y = datasets[0]
@@ -422,9 +510,8 @@ def sgd_optimization_mnist(learning_rate=0.13, n_epochs=1000,
                         )
                     )
 
-                    # save the best model
-                    with open('best_model.pkl', 'w') as f:
-                        cPickle.dump(classifier, f)
+                    # save the weights of the best model
+                    save_model('best_model.npz', classifier)
 
             if patience <= iter:
                 done_looping = True
@@ -451,21 +538,14 @@ def predict():
     to predict labels.
     """
 
-    # load the saved model
-    classifier = cPickle.load(open('best_model.pkl'))
-
-    # compile a predictor function
-    predict_model = theano.function(
-        inputs=[classifier.input],
-        outputs=classifier.y_pred)
+    # load the saved weights once
+    predict_model = BatchPredictor('best_model.npz')
 
     # We can test it on some examples from test test
     dataset='mnist.pkl.gz'
-    datasets = load_data(dataset)
-    test_set_x, test_set_y = datasets[2]
-    test_set_x = test_set_x.get_value()
+    test_set_x, test_set_y = cached_splits(dataset_path(dataset))[2]
 
-    predicted_values = predict_model(test_set_x[:10])
+    predicted_values = predict_model.predict(test_set_x[:10])
     print ("Predicted values for the first 10 examples in test set:")
     print predicted_values
 
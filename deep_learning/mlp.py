@@ -32,16 +32,18 @@ import theano.tensor as T
 import time
 
 
-from logistic_sgd import LogisticRegression, load_data
+from logistic_sgd import LogisticRegression, load_data, cached_splits, dataset_path, set_precision
+from evaluation import AsyncEvaluator
+from pipeline import MinibatchStream
+from checkpoint import save_checkpoint, load_checkpoint, restore, arrays_of
+import numpy_mlp
 
 def set_parameters(clf, params):
-    clf.hiddenLayer.W = theano.shared(value=params[0].get_value(True), name='W', borrow=True)
-    clf.hiddenLayer.b = theano.shared(value=params[1].get_value(True), name='b', borrow=True)
-    clf.logRegressionLayer.W = theano.shared(value=params[2].get_value(True), name='W', borrow=True)
-    clf.logRegressionLayer.b = theano.shared(value=params[3].get_value(True), name='b', borrow=True)
-    clf.hiddenLayer.params = [clf.hiddenLayer.W, clf.hiddenLayer.b]
-    clf.logRegressionLayer.params = [clf.logRegressionLayer.W, clf.logRegressionLayer.b]
-    clf.params = clf.hiddenLayer.params + clf.logRegressionLayer.params
+    for k, layer in enumerate(clf.layers):
+        layer.W = theano.shared(value=params[2 * k].get_value(True), name='W', borrow=True)
+        layer.b = theano.shared(value=params[2 * k + 1].get_value(True), name='b', borrow=True)
+        layer.params = [layer.W, layer.b]
+    clf.params = [param for layer in clf.layers for param in layer.params]
     return clf
 
 
@@ -145,69 +147,65 @@ class MLP(object):
         :param n_in: number of input units, the dimension of the space in
         which the datapoints lie
 
-        :type n_hidden: int
-        :param n_hidden: number of hidden units
+        :type n_hidden: int or list of int
+        :param n_hidden: number of hidden units, or the widths of the hidden
+        layers from the input up
 
         :type n_out: int
         :param n_out: number of output units, the dimension of the space in
         which the labels lie
 
+        :type params: list
+        :param params: optional (W, b) of every layer, input layer first, as
+        in ``params``; used instead of freshly initialized shared variables
+
         """
 
-        # Since we are dealing with a one hidden layer MLP, this will translate
-        # into a HiddenLayer with a tanh activation function connected to the
-        # LogisticRegression layer; the activation function can be replaced by
-        # sigmoid or any other nonlinear function
+        # Every hidden layer is a HiddenLayer with a tanh activation function
+        # fed by the previous one; the activation function can be replaced by
+        # sigmoid or any other nonlinear function. With params, the layers
+        # take their (W, b) pairs in order instead of initializing their own
+        if isinstance(n_hidden, (int, long)):
+            n_hidden = [n_hidden]
         if params is None:
-            self.hiddenLayer = HiddenLayer(
-                rng=rng,
-                input=input,
-                n_in=n_in,
-                n_out=n_hidden,
-                activation=T.tanh
-            )
-
-            # The logistic regression layer gets as input the hidden units
-            # of the hidden layer
-            self.logRegressionLayer = LogisticRegression(
-                input=self.hiddenLayer.output,
-                n_in=n_hidden,
-                n_out=n_out
-            )
-        else:
-            self.hiddenLayer = HiddenLayer(
+            params = [None] * (2 * len(n_hidden) + 2)
+        widths = [n_in] + list(n_hidden)
+        self.hiddenLayers = []
+        layer_input = input
+        for k in xrange(len(n_hidden)):
+            layer = HiddenLayer(
                 rng=rng,
-                input=input,
-                n_in=n_in,
-                n_out=n_hidden,
-                W=params[0],
-                b=params[1],
+                input=layer_input,
+                n_in=widths[k],
+                n_out=widths[k + 1],
+                W=params[2 * k],
+                b=params[2 * k + 1],
                 activation=T.tanh
             )
-
-            # The logistic regression layer gets as input the hidden units
-            # of the hidden layer
-            self.logRegressionLayer = LogisticRegression(
-                input=self.hiddenLayer.output,
-                n_in=n_hidden,
-                W=params[2],
-                b=params[3],
-                n_out=n_out
-            )
-            # end-snippet-2 start-snippet-3
-            # L1 norm ; one regularization option is to enforce L1 norm to
-            # be small
-        self.L1 = (
-            abs(self.hiddenLayer.W).sum()
-            + abs(self.logRegressionLayer.W).sum()
+            self.hiddenLayers.append(layer)
+            layer_input = layer.output
+        # the first hidden layer, as in the one hidden layer MLP
+        self.hiddenLayer = self.hiddenLayers[0]
+
+        # The logistic regression layer gets as input the hidden units
+        # of the last hidden layer
+        self.logRegressionLayer = LogisticRegression(
+            input=layer_input,
+            n_in=widths[-1],
+            W=params[-2],
+            b=params[-1],
+            n_out=n_out
         )
+        # end-snippet-2 start-snippet-3
+        self.layers = self.hiddenLayers + [self.logRegressionLayer]
+
+        # L1 norm ; one regularization option is to enforce L1 norm to
+        # be small
+        self.L1 = sum(abs(layer.W).sum() for layer in self.layers)
 
         # square of L2 norm ; one regularization option is to enforce
         # square of L2 norm to be small
-        self.L2_sqr = (
-            (self.hiddenLayer.W ** 2).sum()
-            + (self.logRegressionLayer.W ** 2).sum()
-        )
+        self.L2_sqr = sum((layer.W ** 2).sum() for layer in self.layers)
 
         # negative log likelihood of the MLP is given by the negative
         # log likelihood of the output of the model, computed in the
@@ -218,16 +216,23 @@ class MLP(object):
         # same holds for the function computing the number of errors
         self.errors = self.logRegressionLayer.errors
 
-        # the parameters of the model are the parameters of the two layer it is
-        # made out of
-        self.params = self.hiddenLayer.params + self.logRegressionLayer.params
+        # the parameters of the model are the parameters of the layers it is
+        # made out of, input layer first
+        self.params = [param for layer in self.layers for param in layer.params]
         # end-snippet-3
 
         # keep track of model input
         self.input = input
 
-    def augment(self, aug1, aug2):
-        return numpy.sum([((x[0] - x[1] + x[2]) ** 2).sum() for x in zip(self.params, aug1, aug2)])
+    def augment(self, aug1, aug2, weights=None):
+        """
+        sum over the parameters of ||param - aug1 + aug2||^2, each term
+        scaled by its entry of weights if given (e.g. a per-layer rho)
+        """
+        if weights is None:
+            weights = [1.] * len(self.params)
+        return numpy.sum([w * ((x[0] - x[1] + x[2]) ** 2).sum()
+                          for x, w in zip(zip(self.params, aug1, aug2), weights)])
 
     # def update(self):
     #     self.hiddenLayer.W = self.updates[0]
@@ -236,7 +241,8 @@ class MLP(object):
     #     self.logRegressionLayer.b = self.updates[3]
 
 def test_mlp(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=1000,
-             dataset='mnist.pkl.gz', batch_size=1000, n_hidden=500):
+             dataset='mnist.pkl.gz', batch_size=1000, n_hidden=500, stream=False,
+             backend='theano', checkpoint=None, checkpoint_every=10, precision='float32'):
     """
     Demonstrate stochastic gradient descent optimization for a multilayer
     perceptron
@@ -262,8 +268,32 @@ def test_mlp(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=1000,
     :param dataset: the path of the MNIST dataset file from
                  http://www.iro.umontreal.ca/~lisa/deep/data/mnist/mnist.pkl.gz
 
+    :type stream: bool
+    :param stream: feed the training set as shuffled minibatches prefetched
+                   from the memory-mapped dataset cache (see pipeline.py)
+                   rather than slicing a shared variable by minibatch index
+
+    :type backend: string
+    :param backend: 'theano', or 'numpy' to train the numpy_mlp model
+                    instead, with nothing to compile
+
+    :type checkpoint: string
+    :param checkpoint: optional directory for checkpoints (see
+                       checkpoint.py) of the parameters, the early-stopping
+                       counters and the shuffling state; a run given a
+                       directory that holds a checkpoint resumes from it
+                       exactly
+
+    :type checkpoint_every: int
+    :param checkpoint_every: write a checkpoint every this many epochs
+
+    :type precision: string
+    :param precision: floating point type of the data, the model and both
+                      backends (see logistic_sgd.set_precision)
+
 
    """
+    set_precision(precision)
     datasets = load_data(dataset)
 
     train_set_x, train_set_y = datasets[0]
@@ -309,8 +339,13 @@ def test_mlp(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=1000,
     )
     # end-snippet-4
 
-    # compiling a Theano function that computes the mistakes that are made
-    # by the model on a minibatch
+    # error rate of the model on the whole validation / test set, scored in
+    # a background process on parameter snapshots (see evaluation.py) so that
+    # training never waits for it
+    evaluator = AsyncEvaluator(classifier, x, y, (valid_set_x, valid_set_y),
+                               (test_set_x, test_set_y))
+
+    trained_params = classifier.params
 
     # start-snippet-5
     # compute the gradient of cost with respect to theta (sotred in params)
@@ -332,15 +367,44 @@ def test_mlp(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=1000,
     # compiling a Theano function `train_model` that returns the cost, but
     # in the same time updates the parameter of the model based on the rules
     # defined in `updates`
-    train_model = theano.function(
-        inputs=[index],
-        outputs=cost,
-        updates=updates,
-        givens={
-            x: train_set_x[index * batch_size: (index + 1) * batch_size],
-            y: train_set_y[index * batch_size: (index + 1) * batch_size]
-        }
-    )
+    if stream:
+        minibatches = MinibatchStream(*cached_splits(dataset_path(dataset))[0],
+                                      batch_size=batch_size, rng=rng)
+    if backend == 'numpy':
+        # the same initial weights, trained by numpy_mlp without any compiled
+        # function
+        model = numpy_mlp.MLP(None, 28 * 28, n_hidden, 10,
+                              params=[numpy.array(p.get_value(), dtype=precision)
+                                      for p in classifier.params])
+        trained_params = model.params
+        if stream:
+            def train_model(batch_x, batch_y):
+                return model.sgd_step(batch_x, batch_y, learning_rate, L1_reg, L2_reg)
+        else:
+            # train_set_y is a cast of the shared label vector
+            data_x = train_set_x.get_value(borrow=True)
+            data_y = numpy.asarray(train_set_y.owner.inputs[0].get_value(borrow=True), dtype='int32')
+
+            def train_model(index):
+                rows = slice(index * batch_size, (index + 1) * batch_size)
+                return model.sgd_step(data_x[rows], data_y[rows], learning_rate, L1_reg, L2_reg)
+    elif stream:
+        # the minibatches are handed over as arrays, shuffled every epoch
+        train_model = theano.function(
+            inputs=[x, y],
+            outputs=cost,
+            updates=updates
+        )
+    else:
+        train_model = theano.function(
+            inputs=[index],
+            outputs=cost,
+            updates=updates,
+            givens={
+                x: train_set_x[index * batch_size: (index + 1) * batch_size],
+                y: train_set_y[index * batch_size: (index + 1) * batch_size]
+            }
+        )
     # end-snippet-5
 
     ###############
@@ -367,55 +431,50 @@ def test_mlp(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=1000,
     epoch = 0
     done_looping = False
 
+    saved = load_checkpoint(checkpoint) if checkpoint is not None else None
+    if saved is not None:
+        arrays, state = saved
+        restore(trained_params, [arrays['param%i' % k] for k in xrange(len(trained_params))])
+        # the generator shuffling the minibatch stream
+        rng.set_state(state['rng'])
+        epoch = state['epoch']
+        patience = state['patience']
+        best_validation_loss = state['best_validation_loss']
+        best_iter = state['best_iter']
+        test_score = state['test_score']
+        start_time -= state['elapsed']
+        print '... resumed from the checkpoint of epoch %i' % epoch
+
     while (epoch < n_epochs) and (not done_looping):
         updating_start_time = time.time()
         epoch = epoch + 1
-        for minibatch_index in xrange(n_train_batches):
+        if stream:
+            batches = enumerate(minibatches)
+        else:
+            batches = ((i, (i,)) for i in xrange(n_train_batches))
+        for minibatch_index, args in batches:
 
-            minibatch_avg_cost = train_model(minibatch_index)
+            minibatch_avg_cost = train_model(*args)
             print minibatch_avg_cost,
             # iteration number
             iter = (epoch - 1) * n_train_batches + minibatch_index
         print
         updating_time = time.time() - updating_start_time
         print 'updating time usage:', updating_time
-        # for p_index in range(len(classifier.params)):
-        #     classifier_validate.params[p_index] = theano.shared(classifier.params[p_index].get_value(True))
-        classifier_validate = MLP(
-            rng=rng,
-            input=x,
-            n_in=28 * 28,
-            n_hidden=n_hidden,
-            n_out=10,
-            params = classifier.params
-        )
-        validate_model = theano.function(
-            inputs=[index],
-            outputs=classifier_validate.errors(y),
-            givens={
-                x: valid_set_x[index * batch_size:(index + 1) * batch_size],
-                y: valid_set_y[index * batch_size:(index + 1) * batch_size]
-            }
-        )
-        test_model = theano.function(
-            inputs=[index],
-            outputs=classifier_validate.errors(y),
-            givens={
-                x: test_set_x[index * batch_size:(index + 1) * batch_size],
-                y: test_set_y[index * batch_size:(index + 1) * batch_size]
-            }
-        )
         if epoch % validation_frequency == 0:
-            # compute zero-one loss on validation set
-            validation_losses = [validate_model(i) for i
-                                 in xrange(n_valid_batches)]
-            this_validation_loss = numpy.mean(validation_losses)
-
+            # hand a copy of the parameters to the background evaluator and
+            # act on whatever it has scored so far, normally the previous
+            # epoch; the last epoch waits for everything still pending
+            evaluator.submit((epoch, iter), trained_params)
+        # a checkpoint is only taken with no snapshot left to score
+        checkpoint_due = checkpoint is not None and epoch % checkpoint_every == 0
+        for (eval_epoch, eval_iter), this_validation_loss, this_test_score in \
+                evaluator.results(wait=epoch >= n_epochs or checkpoint_due):
             print(
                 'epoch %i, minibatch %i/%i, validation error %f %%' %
                 (
-                    epoch,
-                    minibatch_index + 1,
+                    eval_epoch,
+                    n_train_batches,
                     n_train_batches,
                     this_validation_loss * 100.
                 )
@@ -428,25 +487,32 @@ def test_mlp(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=1000,
                     this_validation_loss < best_validation_loss *
                     improvement_threshold
                 ):
-                    patience = max(patience, iter * patience_increase)
+                    patience = max(patience, eval_iter * patience_increase)
 
                 best_validation_loss = this_validation_loss
-                best_iter = iter
+                best_iter = eval_iter
 
-                # test it on the test set
-                test_losses = [test_model(i) for i
-                               in xrange(n_test_batches)]
-                test_score = numpy.mean(test_losses)
+                # the evaluator scored the test set as this is a new best
+                test_score = this_test_score
 
                 print(('     epoch %i, minibatch %i/%i, test error of '
                        'best model %f %%') %
-                      (epoch, minibatch_index + 1, n_train_batches,
+                      (eval_epoch, n_train_batches, n_train_batches,
                        test_score * 100.))
 
-            if patience <= iter:
+            if patience <= eval_iter:
                 done_looping = True
                 break
 
+        if checkpoint_due and not done_looping:
+            save_checkpoint(checkpoint,
+                            dict(('param%i' % k, value) for k, value in enumerate(arrays_of(trained_params))),
+                            {'epoch': epoch, 'patience': patience,
+                             'best_validation_loss': best_validation_loss, 'best_iter': best_iter,
+                             'test_score': test_score, 'rng': rng.get_state(),
+                             'elapsed': timeit.default_timer() - start_time})
+
+    evaluator.close()
     end_time = timeit.default_timer()
     print(('Optimization complete. Best validation score of %f %% '
            'obtained at iteration %i, with test performance %f %%') %
@@ -27,8 +27,13 @@ import numpy
 import time
 import theano
 import theano.tensor as T
-from logistic_sgd import load_data
+from logistic_sgd import load_data, set_precision, cached_splits, dataset_path
+from evaluation import AsyncEvaluator
 from mlp import MLP
+from admm_pool import WorkerPool, worker_shards, inner_schedule, local_solve, per_tensor, gossip_mix, \
+    shard_stream, stream_schedule
+from topology import make_topology
+from checkpoint import save_checkpoint, load_checkpoint, restore, arrays_of
 
 
 def params_shape_like_shared(params):
@@ -48,17 +53,168 @@ def params_shape_like_noise(params):
     l = []
     numpy.random.seed(1)
     for k in params:
-        l.append(numpy.random.random(k.get_value(True).shape))
+        l.append(numpy.random.random(k.get_value(True).shape).astype(k.dtype))
     return l
 
 def set_parameters(clf, params):
-    clf.hiddenLayer.W = theano.shared(params[0].get_value(True))
-    clf.hiddenLayer.b = theano.shared(params[1].get_value(True))
-    clf.logRegressionLayer.W = theano.shared(params[2].get_value(True))
-    clf.logRegressionLayer.b = theano.shared(params[3].get_value(True))
+    for k, layer in enumerate(clf.layers):
+        layer.W = theano.shared(params[2 * k].get_value(True))
+        layer.b = theano.shared(params[2 * k + 1].get_value(True))
     return clf
 
 
+def worker_init(rng, n_workers, n_in, n_hidden, n_out):
+    """
+    Initial parameters of all ADMM workers, one (n_workers, ...) array per
+    parameter tensor; worker i owns slice i. The slices are initialized the
+    way MLP initializes its own parameters; n_hidden is a width or a list of
+    hidden layer widths.
+    """
+    if not isinstance(n_hidden, (list, tuple)):
+        n_hidden = [n_hidden]
+    widths = [n_in] + list(n_hidden)
+    stacks = []
+    for k in xrange(len(n_hidden)):
+        bound = numpy.sqrt(6. / (widths[k] + widths[k + 1]))
+        stacks.append(numpy.asarray([rng.uniform(low=-bound, high=bound, size=(widths[k], widths[k + 1]))
+                                     for i in xrange(n_workers)], dtype=theano.config.floatX))
+        stacks.append(numpy.zeros((n_workers, widths[k + 1]), dtype=theano.config.floatX))
+    shapes = [(widths[-1], n_out), (n_out,)]
+    return stacks + [numpy.zeros((n_workers,) + shape, dtype=theano.config.floatX) for shape in shapes]
+
+
+def worker_stacks(rng, n_workers, n_in, n_hidden, n_out):
+    """
+    worker_init as stacked shared buffers, one per parameter tensor.
+    """
+    return [theano.shared(value=value, name='W_s' if value.ndim == 3 else 'b_s', borrow=True)
+            for value in worker_init(rng, n_workers, n_in, n_hidden, n_out)]
+
+
+def stacks_like(stacks, dtype=None):
+    return [theano.shared(numpy.zeros_like(s.get_value(borrow=True), dtype=dtype), borrow=True) for s in stacks]
+
+
+def consensus_update(w_params, w_duals, update_params, active=None):
+    """
+    One consensus round over all workers, in place and without per-worker
+    copies: for every parameter tensor
+
+        z = mean_i(x_i + u_i),    u_i = u_i + x_i - z
+
+    where x_i, u_i are the slices of the stacked worker parameters and scaled
+    duals and z is written into update_params. The dual buffer first holds
+    x_i + u_i, so the dual update is a single broadcast subtraction. The mean
+    accumulates in the type of z, which may be wider than the workers'.
+
+    Duals stored in a lower precision than the parameters would lose x_i + u_i
+    to cancellation that way; they are averaged separately and updated worker
+    by worker in the parameters' precision instead.
+
+    If only the workers in active took part in the round, the others enter
+    the mean with their last x_i + u_i, so z still averages over all shards
+    and each fresh x_i weighs 1 / n_workers; only the active duals move.
+    """
+    for w, u, z in zip(w_params, w_duals, update_params):
+        if u.dtype == w.dtype and active is None:
+            u += w
+            u.mean(axis=0, dtype=z.dtype, out=z)
+            u -= z
+        else:
+            w.mean(axis=0, dtype=z.dtype, out=z)
+            z += u.mean(axis=0, dtype=z.dtype)
+            for i in (xrange(w.shape[0]) if active is None else active):
+                u[i] += w[i] - z
+    return update_params
+
+
+def gossip_update(w_params, w_duals, targets, neighbours):
+    """
+    One round of decentralized consensus, in place: worker i only sees the
+    parameters of its neighbours (see topology) and, with xbar_i their mean,
+
+        u_i = u_i + (x_i - xbar_i) / 2,    t_i = (x_i + xbar_i) / 2
+
+    The local problem of decentralized ADMM, f_i(x) + <x, alpha_i> +
+    rho sum_j ||x - (x_i + x_j) / 2||^2 over the neighbours j, is the usual
+    augmented one with z replaced by the worker's own target t_i and rho by
+    2 * degree * rho, which the caller takes care of. The WorkerPool runs
+    the same mix in its processes (see WorkerPool.mix_round).
+    """
+    for i in xrange(neighbours.shape[0]):
+        gossip_mix(w_params, w_duals, targets, neighbours, i)
+    return targets
+
+
+def residuals(w_params, update_params, previous, rhos):
+    """
+    Primal and dual residual of every parameter tensor after a consensus
+    round,
+
+        r = sqrt(sum_i ||x_i - z_i||^2),    s = rho sqrt(sum_i ||z_i - z_i'||^2)
+
+    with z_i the consensus (the same for all workers) or the worker's own
+    target, and z_i' its value before the round.
+    """
+    r = []
+    s = []
+    for w, z, z_prev, rho in zip(w_params, update_params, previous, rhos):
+        shared = z.ndim < w.ndim
+        r.append(numpy.sqrt(sum(((w[i] - (z if shared else z[i])) ** 2).sum() for i in xrange(w.shape[0]))))
+        change = ((z - z_prev) ** 2).sum()
+        s.append(rho * numpy.sqrt(change * w.shape[0] if shared else change))
+    return r, s
+
+
+def balance_rho(rhos, w_duals, indices, r, s, mu=10., tau=2., max_rho=numpy.inf):
+    """
+    Residual balancing (Boyd et al., "Distributed Optimization and
+    Statistical Learning via ADMM", 3.4.1) of the penalties of the tensors
+    in indices, whose residuals are r and s, in place: rho grows by tau while
+    the primal residual is more than mu times the dual one and shrinks in
+    the opposite case. The duals are scaled ones, u = y / rho, so they are
+    rescaled with it.
+
+    The rule assumes exactly solved local problems. Workers taking a few
+    gradient steps keep a primal residual that no rho removes, so rho would
+    grow every round; it is never raised above max_rho.
+    """
+    for k, r_k, s_k in zip(indices, r, s):
+        if r_k > mu * s_k:
+            if rhos[k] * tau > max_rho:
+                continue
+            rhos[k] *= tau
+            w_duals[k] /= tau
+        elif s_k > mu * r_k:
+            rhos[k] /= tau
+            w_duals[k] *= tau
+    return rhos
+
+
+def select(tensors, indices):
+    return [tensors[k] for k in indices]
+
+
+def consensus_step(param_stacks, dual_stacks, update_params, active=None):
+    """consensus_update on borrowed views of stacked shared buffers"""
+    consensus_update([s.get_value(borrow=True) for s in param_stacks],
+                     [s.get_value(borrow=True) for s in dual_stacks],
+                     update_params, active)
+    for u_stack in dual_stacks:
+        u_stack.set_value(u_stack.get_value(borrow=True), borrow=True)
+    return update_params
+
+
+def gossip_step(param_stacks, dual_stacks, targets, neighbours):
+    """gossip_update on borrowed views of stacked shared buffers"""
+    gossip_update([s.get_value(borrow=True) for s in param_stacks],
+                  [s.get_value(borrow=True) for s in dual_stacks],
+                  targets, neighbours)
+    for u_stack in dual_stacks:
+        u_stack.set_value(u_stack.get_value(borrow=True), borrow=True)
+    return targets
+
+
 # start-snippet-1
 class HiddenLayer(object):
     def __init__(self, rng, input, n_in, n_out, W=None, b=None,
@@ -136,7 +292,12 @@ class HiddenLayer(object):
 # start-snippet-2
 
 def test_mlp_admm(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=30000,
-                  dataset='mnist.pkl.gz', batch_size=1000, n_hidden=500, rho=0.05):
+                  dataset='mnist.pkl.gz', batch_size=1000, n_hidden=500, rho=0.05, n_procs=0,
+                  inner_steps=None, inner_tol=None, sub_batch_size=None, momentum=0.,
+                  n_workers=None, dual_dtype=None, backend='theano', consensus_every=1,
+                  topology=None, participation=1., adapt_rho=False, adapt_every=5,
+                  checkpoint=None, checkpoint_every=10, precision='float32', master_dtype=None,
+                  stream=False):
     """
     Demonstrate stochastic gradient descent optimization for a multilayer
     perceptron
@@ -162,20 +323,122 @@ def test_mlp_admm(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=30000,
     :param dataset: the path of the MNIST dataset file from
                  http://www.iro.umontreal.ca/~lisa/deep/data/mnist/mnist.pkl.gz
 
+    :type n_hidden: int or list of int
+    :param n_hidden: number of hidden units, or the widths of the hidden
+    layers from the input up
+
+    :type rho: float or list of float
+    :param rho: penalty of the consensus constraints, or one per layer
+    (hidden layers, then the softmax layer); the initial one with adapt_rho
+
+    :type n_procs: int
+    :param n_procs: number of processes solving the worker subproblems in
+    parallel (see admm_pool); 0 solves them one after another in this process
+
+    :type inner_steps: int
+    :param inner_steps: number of local gradient steps every worker takes per
+    consensus round, cycling over the sub-minibatches of its shard; one pass
+    over the shard by default
+
+    :type inner_tol: float
+    :param inner_tol: optional, end a worker's local solve early once its
+    cost changes by less than this (relative) between two steps
+
+    :type sub_batch_size: int
+    :param sub_batch_size: size of the sub-minibatches a worker's shard is
+    split into for the inner steps; batch_size by default
+
+    :type momentum: float
+    :param momentum: momentum of the local gradient steps
+
+    :type n_workers: int
+    :param n_workers: number of ADMM workers, each owning a contiguous shard
+    of the minibatches, at most one per minibatch; one per minibatch by
+    default
+
+    :type dual_dtype: string
+    :param dual_dtype: optional storage type of the scaled duals, e.g.
+    'float32' or 'float16'; the parameters' type by default
+
+    :type backend: string
+    :param backend: 'theano', or 'numpy' to run the local solves with the
+    uncompiled numpy_mlp model (through admm_pool, in n_procs processes or in
+    this one)
+
+    :type consensus_every: int or list of int
+    :param consensus_every: run the consensus and dual updates every this
+    many rounds, or per layer; large layers, the expensive ones to
+    communicate, can sync less often while the workers keep solving against
+    their last consensus
+
+    :type topology: string
+    :param topology: optional, 'ring', 'torus', 'expander' or
+    'expander:<degree>' (see topology): decentralized ADMM, where every worker
+    only exchanges parameters with its neighbours in that graph instead of
+    all workers being averaged into one consensus; the model evaluated is
+    worker 0's
+
+    :type participation: float
+    :param participation: fraction of the workers sampled to solve and report
+    each round; the others keep their last parameters and duals, so a round
+    costs that fraction of a full one and no straggler holds it up (not
+    with a topology, whose dual updates need every worker)
+
+    :type adapt_rho: bool
+    :param adapt_rho: adapt the rho of every parameter tensor by balancing
+    its primal and dual residuals (see balance_rho), so that layers of very
+    different sizes need no hand-tuned rho; rho stays at most
+    (1 - momentum) / learning_rate, half the value at which the local
+    gradient steps on the augmented term diverge
+
+    :type adapt_every: int
+    :param adapt_every: with adapt_rho, adapt rho every this many rounds
+
+    :type checkpoint: string
+    :param checkpoint: optional directory for checkpoints (see checkpoint.py)
+    of the consensus, the workers' parameters, duals and velocities, rho,
+    the early-stopping counters and the sampling state; a run given a
+    directory that holds a checkpoint resumes from it exactly
+
+    :type checkpoint_every: int
+    :param checkpoint_every: write a checkpoint every this many epochs
+
+    :type precision: string
+    :param precision: floating point type of the data, the models, the
+    consensus variables and all worker buffers (see
+    logistic_sgd.set_precision)
+
+    :type master_dtype: string
+    :param master_dtype: optional, e.g. 'float64': keep master copies of
+    the consensus variables in this type, so that averaging many workers
+    does not round in the compute precision; the workers still receive
+    them in precision
+
+    :type stream: bool
+    :param stream: read the workers' shards from the memory-mapped dataset
+    cache (see pipeline.py) rather than from a copy of the training set in
+    memory, each inner step on a sub-minibatch shuffled anew every epoch
+
 
    """
 
-    f = open('result.txt', 'w')
+    set_precision(precision)
     datasets = load_data(dataset)
 
     train_set_x, train_set_y = datasets[0]
     valid_set_x, valid_set_y = datasets[1]
     test_set_x, test_set_y = datasets[2]
 
-    # compute number of minibatches for training, validation and testing
-    n_train_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
-    n_valid_batches = valid_set_x.get_value(borrow=True).shape[0] / batch_size
-    n_test_batches = test_set_x.get_value(borrow=True).shape[0] / batch_size
+    if stream:
+        train_x, train_y = cached_splits(dataset_path(dataset))[0]
+    else:
+        train_x = train_set_x.get_value(borrow=True)
+        # train_set_y is a cast of the shared label vector, the workers need
+        # the labels themselves
+        train_y = train_set_y.owner.inputs[0].get_value(borrow=True)
+
+    # compute number of minibatches for training
+    n_train_batches = train_x.shape[0] / batch_size
 
     ######################
     # BUILD ACTUAL MODEL #
@@ -183,25 +446,9 @@ def test_mlp_admm(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=30000,
     print '... building the model'
 
     # allocate symbolic variables for the data
-    index = T.lscalar()  # index to a [mini]batch
     x = T.matrix('x')  # the data is presented as rasterized images
     y = T.ivector('y')  # the labels are presented as 1D vector of
     # [int] labels
-    hw1 = T.matrix('hw1')
-    hb1 = T.dvector('hb1')
-    lw = T.matrix('lw')
-    lb = T.dvector('hb')
-
-    a1_hw1 = T.matrix('a1_hw1')
-    a1_hb1 = T.dvector('a1_hb1')
-    a1_lw = T.matrix('a1_lw')
-    a1_lb = T.dvector('a1_hb')
-
-    a2_hw1 = T.matrix('a2_hw1')
-    a2_hb1 = T.dvector('a2_hb1')
-    a2_lw = T.matrix('a2_lw')
-    a2_lb = T.dvector('a2_hb')
-
     rng = numpy.random.RandomState(1234)
 
     # construct the MLP class
@@ -213,73 +460,103 @@ def test_mlp_admm(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=30000,
         n_out=10
     )
 
+    n_layers = len(classifier.layers)
+    # the consensus variables, one symbolic input per parameter tensor
+    new_params = [param.type('new_' + param.name) for param in classifier.params]
     update_model = theano.function(
-        inputs=[hw1, hb1, lw, lb],
+        inputs=new_params,
         updates=[(param, uparam)
-                 for param, uparam in zip(classifier.params, [hw1, hb1, lw, lb])
+                 for param, uparam in zip(classifier.params, new_params)
                  ]
     )
 
-    test_model = theano.function(
-        inputs=[index],
-        outputs=classifier.errors(y),
-        givens={
-            x: test_set_x[index * batch_size:(index + 1) * batch_size],
-            y: test_set_y[index * batch_size:(index + 1) * batch_size]
-        }
-    )
-
-    validate_model = theano.function(
-        inputs=[index],
-        outputs=classifier.errors(y),
-        givens={
-            x: valid_set_x[index * batch_size:(index + 1) * batch_size],
-            y: valid_set_y[index * batch_size:(index + 1) * batch_size]
-        }
-    )
-
-    classifier_s = []
-    cost_s = []
-    train_model_s = []
-    gparams_s = []
-    updates_s = []
-    w_params_s = []
-    for i in range(n_train_batches):
-        classifier_s.append(MLP(
+    # validation and test run in a background process on parameter snapshots
+    evaluator = AsyncEvaluator(classifier, x, y, (valid_set_x, valid_set_y),
+                               (test_set_x, test_set_y))
+
+    # n_workers ADMM workers, each owning a contiguous shard of minibatches.
+    # Rather than one MLP and one compiled function per worker, the parameters
+    # and (scaled) duals of all workers live in stacked buffers and a single
+    # compiled function updates the slice selected by the worker index, so
+    # memory grows with the number of workers, not with the dataset
+    if n_workers is None:
+        n_workers = n_train_batches
+    shards = worker_shards(n_train_batches, n_workers, batch_size)
+    sub_batch_size = sub_batch_size or batch_size
+    # workers solving and reporting per round
+    n_active = max(int(round(participation * n_workers)), 1)
+    if n_active < n_workers and topology is not None:
+        raise ValueError('partial participation needs the central consensus, not a topology')
+    neighbours = None
+    if topology is not None:
+        neighbours = make_topology(topology, n_workers)
+        # a worker is pulled towards each of its neighbours, i.e. towards
+        # its own target with degree times the penalty (see gossip_update)
+        degree = neighbours.shape[1]
+        rho = [2 * degree * r for r in rho] if isinstance(rho, (list, tuple)) else 2 * degree * rho
+    if n_procs > 0 or backend == 'numpy':
+        pool = WorkerPool(n_procs, train_x, train_y, shards,
+                          worker_init(rng, n_workers, 28 * 28, n_hidden, 10),
+                          n_in=28 * 28, n_hidden=n_hidden, n_out=10, learning_rate=learning_rate,
+                          L1_reg=L1_reg, L2_reg=L2_reg, rho=rho, inner_steps=inner_steps,
+                          inner_tol=inner_tol, sub_batch_size=sub_batch_size, momentum=momentum,
+                          dual_dtype=dual_dtype, backend=backend, neighbours=neighbours, stream=stream)
+    else:
+        pool = None
+        worker = T.lscalar('worker')
+        param_stacks = worker_stacks(rng, n_workers, 28 * 28, n_hidden, 10)
+        dual_stacks = stacks_like(param_stacks, dual_dtype)
+        local_params = [s[worker] for s in param_stacks]
+        local_duals = [T.cast(s[worker], p.dtype) for s, p in zip(dual_stacks, param_stacks)]
+
+        local_classifier = MLP(
             rng=rng,
             input=x,
             n_in=28 * 28,
             n_hidden=n_hidden,
-            n_out=10)
+            n_out=10,
+            params=local_params
         )
-        w_params_s.append(params_shape_like(classifier_s[i].params))
-        cost_s.append(classifier_s[i].negative_log_likelihood(y)
-                      + L1_reg * classifier_s[i].L1
-                      + L2_reg * classifier_s[i].L2_sqr
-                      + 0.5 * rho * classifier_s[i].augment([a1_hw1, a1_hb1, a1_lw, a1_lb],
-                                                            [a2_hw1, a2_hb1, a2_lw, a2_lb])
+        z_params = [param.type('z_' + param.name) for param in classifier.params]
+        # the penalties are inputs, so that adapting them needs no recompile
+        rho_params = [T.scalar('rho_' + param.name) for param in classifier.params]
+        local_cost = (local_classifier.negative_log_likelihood(y)
+                      + L1_reg * local_classifier.L1
+                      + L2_reg * local_classifier.L2_sqr
+                      + 0.5 * local_classifier.augment(z_params, local_duals, rho_params)
                       )
-        gparams_s.append([T.grad(cost_s[i], param) for param in classifier_s[i].params])
-        updates_s.append([(param, param - learning_rate * gparam)
-                          for param, gparam in zip(classifier_s[i].params, gparams_s[i])
-                          ])
-        train_model_s.append(theano.function(
-            inputs=[index, a1_hw1, a1_hb1, a1_lw, a1_lb, a2_hw1, a2_hb1, a2_lw, a2_lb],
-            outputs=cost_s[i],
-            updates=updates_s[i],
-            givens={
-                x: train_set_x[index * batch_size: (index + 1) * batch_size],
-                y: train_set_y[index * batch_size: (index + 1) * batch_size],
-                # a1_hw1:classifier.params[0],
-                # a1_hb1:classifier.params[1],
-                # a1_lw:classifier.params[2],
-                # a1_lb:classifier.params[3],
-                # a2_hw1:w_params_s[i][0],
-                # a2_hb1:w_params_s[i][1],
-                # a2_lw:w_params_s[i][2],
-                # a2_lb:w_params_s[i][3]
-            })
-        )
+        local_gparams = [T.grad(local_cost, param) for param in local_params]
+        if momentum:
+            velocity_stacks = stacks_like(param_stacks)
+            local_velocities = [momentum * s[worker] - learning_rate * gparam
+                                for s, gparam in zip(velocity_stacks, local_gparams)]
+            local_updates = [(s, T.set_subtensor(s[worker], v))
+                             for s, v in zip(velocity_stacks, local_velocities)] + \
+                            [(stack, T.inc_subtensor(param, v))
+                             for stack, param, v in zip(param_stacks, local_params, local_velocities)]
+        else:
+            local_updates = [(stack, T.inc_subtensor(param, -learning_rate * gparam))
+                             for stack, param, gparam in zip(param_stacks, local_params, local_gparams)]
+        if stream:
+            # one gradient step of a worker on a streamed sub-minibatch
+            train_worker = theano.function(
+                inputs=[x, y, worker] + z_params + rho_params,
+                outputs=local_cost,
+                updates=local_updates
+            )
+        else:
+            # one gradient step of a worker on rows [start, stop) of its shard
+            start = T.lscalar('start')
+            stop = T.lscalar('stop')
+            train_worker = theano.function(
+                inputs=[start, stop, worker] + z_params + rho_params,
+                outputs=local_cost,
+                updates=local_updates,
+                givens={
+                    x: train_set_x[start:stop],
+                    y: train_set_y[start:stop]
+                }
+            )
 
     # start-snippet-4
     # the cost we minimize during training is the negative log likelihood of
@@ -357,64 +634,176 @@ def test_mlp_admm(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=30000,
 
     best_validation_loss = numpy.inf
     best_iter = 0
+    best_time = 0.
     test_score = 0.
     start_time = timeit.default_timer()
 
     epoch = 0
     done_looping = False
-    update_params = params_shape_like(classifier.params)
+    if pool is None:
+        worker_params = [s.get_value(borrow=True) for s in param_stacks]
+        worker_duals = [s.get_value(borrow=True) for s in dual_stacks]
+        rhos = numpy.asarray(per_tensor(rho, n_layers), dtype='float64')
+        if topology is None:
+            update_params = params_shape_like(classifier.params)
+        else:
+            # one consensus target per worker
+            update_params = [numpy.zeros_like(w) for w in worker_params]
+    else:
+        worker_params = pool.params
+        worker_duals = pool.duals
+        # the pool processes read rho from shared memory as well
+        rhos = pool.rho
+        # the pool processes read the consensus variables from shared memory
+        update_params = pool.z
+    if master_dtype is not None:
+        masters = [numpy.zeros(z.shape, dtype=master_dtype) for z in update_params]
+        consensus = masters
+    else:
+        masters = []
+        consensus = update_params
+    every = per_tensor(consensus_every, n_layers)
+    participation_rng = numpy.random.RandomState(4321)
+    # seconds into training at which each epoch's snapshot was taken
+    snapshot_time = {}
+
+    def training_state():
+        # everything a round reads or writes, by checkpoint name
+        if pool is None:
+            stacks = [('param', param_stacks), ('dual', dual_stacks),
+                      ('vel', velocity_stacks if momentum else [])]
+        else:
+            stacks = [('param', pool.params), ('dual', pool.duals), ('vel', pool.velocities)]
+        return stacks + [('z', update_params), ('master', masters), ('rho', [rhos])]
+
+    saved = load_checkpoint(checkpoint) if checkpoint is not None else None
+    # a resumed run continues the results of the one it resumes
+    f = open('result.txt', 'w' if saved is None else 'a')
+    if saved is not None:
+        arrays, state = saved
+        for name, tensors in training_state():
+            restore(tensors, [arrays['%s%i' % (name, k)] for k in xrange(len(tensors))])
+        if pool is None:
+            worker_params = [s.get_value(borrow=True) for s in param_stacks]
+            worker_duals = [s.get_value(borrow=True) for s in dual_stacks]
+        if topology is None:
+            update_model(*update_params)
+        else:
+            update_model(*[w[0] for w in worker_params])
+        participation_rng.set_state(state['participation_rng'])
+        epoch = state['epoch']
+        patience = state['patience']
+        best_validation_loss = state['best_validation_loss']
+        best_iter = state['best_iter']
+        best_time = state['best_time']
+        test_score = state['test_score']
+        start_time -= state['elapsed']
+        print '... resumed from the checkpoint of epoch %i' % epoch
     while (epoch < n_epochs) and (not done_looping):
         updating_start_time = time.time()
         epoch = epoch + 1
-        tmp = params_shape_like(classifier.params)
-        for minibatch_index in xrange(n_train_batches):
-            minibatch_avg_cost = train_model_s[minibatch_index](minibatch_index,
-                                                                update_params[0],
-                                                                update_params[1],
-                                                                update_params[2],
-                                                                update_params[3],
-                                                                w_params_s[minibatch_index][0],
-                                                                w_params_s[minibatch_index][1],
-                                                                w_params_s[minibatch_index][2],
-                                                                w_params_s[minibatch_index][3])
-            # print minibatch_avg_cost,
-            iter = (epoch - 1) * n_train_batches + minibatch_index
-            for p_index in range(len(classifier.params)):
-                tmp[p_index] += classifier_s[minibatch_index].params[p_index].get_value(True) + \
-                               w_params_s[minibatch_index][p_index]
-
-
-        for p_index in range(len(classifier.params)):
-            update_params[p_index] = tmp[p_index] / n_train_batches
-
-        for minibatch_index in xrange(n_train_batches):
-            for p_index in range(len(classifier_s[minibatch_index].params)):
-                w_params_s[minibatch_index][p_index] += classifier_s[minibatch_index].params[p_index].get_value(True) - \
-                                                        update_params[p_index]
+        if n_active < n_workers:
+            active = sorted(participation_rng.choice(n_workers, n_active, replace=False))
+        else:
+            active = None
+        if pool is None:
+            local_results = []
+            for minibatch_index in (xrange(n_workers) if active is None else active):
+                z = update_params if topology is None else [t[minibatch_index] for t in update_params]
+                inputs = z + [float(r) for r in rhos]
+
+                def step(a, b):
+                    # (start, stop) rows or a streamed (x, y) sub-minibatch
+                    return train_worker(a, b, minibatch_index, *inputs)
+                if stream:
+                    schedule = stream_schedule(shard_stream(train_x, train_y, shards[minibatch_index],
+                                                            sub_batch_size, minibatch_index, epoch),
+                                               inner_steps)
+                else:
+                    schedule = inner_schedule(shards[minibatch_index], inner_steps, sub_batch_size)
+                local_results.append(local_solve(step, schedule, inner_tol))
+            # the compiled updates need not keep the stacks in place
+            worker_params = [s.get_value(borrow=True) for s in param_stacks]
+            worker_duals = [s.get_value(borrow=True) for s in dual_stacks]
+        else:
+            local_results = pool.run_round(active, epoch)
+        # the parameter tensors whose layer syncs this round; all of them in
+        # the first round, so that no layer is left with the zero consensus
+        synced = [k for k in xrange(len(every)) if epoch % every[k] == 0 or epoch == 1]
+        previous = [c.copy() for c in select(consensus, synced)]
+        if topology is not None:
+            if pool is None:
+                gossip_step(select(param_stacks, synced), select(dual_stacks, synced),
+                            select(consensus, synced), neighbours)
+            else:
+                # every pool process mixes its workers with their neighbours,
+                # into the shared targets
+                pool.mix_round(synced)
+                for k in synced if masters else []:
+                    masters[k][...] = update_params[k]
+        elif pool is None:
+            consensus_step(select(param_stacks, synced), select(dual_stacks, synced),
+                           select(consensus, synced), active)
+        else:
+            consensus_update(select(pool.params, synced), select(pool.duals, synced),
+                             select(consensus, synced), active)
+        if masters:
+            # what the workers solve against, in their precision
+            for k in synced:
+                update_params[k][...] = masters[k]
+        primal, dual = residuals(select(worker_params, synced), select(consensus, synced), previous,
+                                 select(rhos, synced))
+        print 'primal residuals:', ' '.join('%.3g' % v for v in primal)
+        print 'dual residuals:', ' '.join('%.3g' % v for v in dual)
+        if adapt_rho and epoch % adapt_every == 0:
+            balance_rho(rhos, worker_duals, synced, primal, dual,
+                        max_rho=(1. - momentum) / learning_rate)
+            if pool is None:
+                for u_stack in dual_stacks:
+                    u_stack.set_value(u_stack.get_value(borrow=True), borrow=True)
+            print 'rho:', ' '.join('%.3g' % v for v in rhos)
+        minibatch_index = n_train_batches - 1
+        iter = (epoch - 1) * n_train_batches + minibatch_index
 
 
         # update_model(update_params[0], update_params[1], update_params[2], update_params[3])
 
-        update_model(update_params[0], update_params[1], update_params[2], update_params[3])
+        if topology is None:
+            update_model(*update_params)
+        else:
+            update_model(*[w[0] for w in worker_params])
         # print classifier.params[3].get_value(True)
         # print
         updating_time = time.time() - updating_start_time
-        print 'updating time usage:', updating_time / n_train_batches
-        f.writelines('updating time usage:' + str(updating_time / n_train_batches) + '\n')
+        # the local solves, consensus and dual updates of the round, also per
+        # inner step taken by any worker, as rounds differ in their steps
+        step_time = updating_time / sum(k for c, k in local_results)
+        print 'round time usage:', updating_time
+        print 'time per inner step:', step_time
+        if inner_steps is not None or n_workers != n_train_batches:
+            print 'average inner steps:', numpy.mean([k for c, k in local_results])
+        f.writelines('round time usage:' + str(updating_time) + '\n')
+        f.writelines('time per inner step:' + str(step_time) + '\n')
 
         if epoch % validation_frequency == 0:
-            # compute zero-one loss on validation set
-            validation_losses = [validate_model(i) for i
-                                 in xrange(n_valid_batches)]
-            this_validation_loss = numpy.mean(validation_losses)
-
+            # hand a copy of the consensus parameters to the background
+            # evaluator and act on whatever it has scored so far, normally the
+            # previous epoch; the last epoch waits for everything still pending
+            snapshot_time[epoch] = timeit.default_timer() - start_time
+            evaluator.submit((epoch, iter), classifier.params)
+        # a checkpoint is only taken with no snapshot left to score
+        checkpoint_due = checkpoint is not None and epoch % checkpoint_every == 0
+        for (eval_epoch, eval_iter), this_validation_loss, this_test_score in \
+                evaluator.results(wait=epoch >= n_epochs or checkpoint_due):
+            eval_time = snapshot_time.pop(eval_epoch)
             print(
-                'epoch %i, minibatch %i/%i, validation error %f %%' %
+                'epoch %i, minibatch %i/%i, validation error %f %%, %.1fs into training' %
                 (
-                    epoch,
-                    minibatch_index + 1,
+                    eval_epoch,
+                    n_train_batches,
                     n_train_batches,
-                    this_validation_loss * 100.
+                    this_validation_loss * 100.,
+                    eval_time
                 )
             )
             f.writelines('validation error:' + str(this_validation_loss * 100.) + '\n')
@@ -426,30 +815,46 @@ def test_mlp_admm(learning_rate=0.5, L1_reg=0.00, L2_reg=0.0001, n_epochs=30000,
                             this_validation_loss < best_validation_loss *
                             improvement_threshold
                 ):
-                    patience = max(patience, iter * patience_increase)
+                    patience = max(patience, eval_iter * patience_increase)
 
                 best_validation_loss = this_validation_loss
-                best_iter = iter
+                best_iter = eval_iter
+                best_time = eval_time
 
-                # test it on the test set
-                test_losses = [test_model(i) for i
-                               in xrange(n_test_batches)]
-                test_score = numpy.mean(test_losses)
+                # the evaluator scored the test set as this is a new best
+                test_score = this_test_score
 
                 print(('     epoch %i, minibatch %i/%i, test error of '
                        'best model %f %%') %
-                      (epoch, minibatch_index + 1, n_train_batches,
+                      (eval_epoch, n_train_batches, n_train_batches,
                        test_score * 100.))
                 f.writelines('test error:' + str(test_score * 100.) + '\n')
 
-            if patience <= iter:
+            if patience <= eval_iter:
                 done_looping = True
                 break
 
+        if checkpoint_due and not done_looping:
+            save_checkpoint(checkpoint,
+                            dict(('%s%i' % (name, k), value)
+                                 for name, tensors in training_state()
+                                 for k, value in enumerate(arrays_of(tensors))),
+                            {'epoch': epoch, 'patience': patience,
+                             'best_validation_loss': best_validation_loss, 'best_iter': best_iter,
+                             'best_time': best_time, 'test_score': test_score,
+                             'participation_rng': participation_rng.get_state(),
+                             'elapsed': timeit.default_timer() - start_time})
+
+    evaluator.close()
+    if pool is not None:
+        pool.close()
     end_time = timeit.default_timer()
     print(('Optimization complete. Best validation score of %f %% '
            'obtained at iteration %i, with test performance %f %%') %
           (best_validation_loss * 100., best_iter + 1, test_score * 100.))
+    print('time to the best validation score with %i of %i workers per round: %.1fs' %
+          (n_active, n_workers, best_time))
+    f.writelines('time to best:' + str(best_time) + '\n')
     print >> sys.stderr, ('The code for file ' +
                           os.path.split(__file__)[1] +
                           ' ran for %.2fm' % ((end_time - start_time) / 60.))
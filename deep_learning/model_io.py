@@ -0,0 +1,150 @@
+"""
+Weight-only model files and batch prediction.
+
+A model is stored as the (W, b) pairs of its layers, input layer first, in
+an uncompressed ``.npz`` file with members W0, b0, W1, b1, ... Writing it is
+a plain copy of the arrays, and since the members are stored rather than
+deflated, load_params can memory-map them in place. This covers both
+LogisticRegression (one layer) and MLP (tanh hidden layers followed by the
+softmax layer).
+
+BatchPredictor loads such a file once and scores inputs of any size, e.g.
+memory-mapped arrays, in chunks small enough for their activations to stay
+in cache. The forward pass is plain numpy, whose matrix products release
+the GIL, so chunks can be spread over threads.
+"""
+__docformat__ = 'restructedtext en'
+
+import struct
+import zipfile
+from multiprocessing.pool import ThreadPool
+
+import numpy
+from numpy.lib import format as npy_format
+
+
+def save_params(path, params):
+    """
+    write the (W, b) pairs of params, given as arrays or shared variables in
+    the order of classifier.params, to path
+    """
+    values = [p.get_value(borrow=True) if hasattr(p, 'get_value') else p for p in params]
+    arrays = {}
+    for k in xrange(0, len(values), 2):
+        arrays['W%i' % (k // 2)] = values[k]
+        arrays['b%i' % (k // 2)] = values[k + 1]
+    with open(path, 'wb') as f:
+        numpy.savez(f, **arrays)
+
+
+def save_model(path, classifier):
+    save_params(path, classifier.params)
+
+
+def _member_offset(f, info):
+    # the data of a stored member starts after its local file header, whose
+    # name and extra field lengths may differ from the central directory
+    f.seek(info.header_offset)
+    header = f.read(30)
+    name_len, extra_len = struct.unpack('<HH', header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+def load_params(path, mmap=True):
+    """
+    the list [W0, b0, W1, b1, ...] stored in path; with mmap, the arrays
+    are read-only memory maps of the file instead of copies
+    """
+    with numpy.load(path) as data:
+        n_layers = len([name for name in data.files if name.startswith('W')])
+        if not mmap:
+            return [data[name % k] for k in xrange(n_layers) for name in ('W%i', 'b%i')]
+
+    with zipfile.ZipFile(path) as archive:
+        infos = dict((info.filename, info) for info in archive.infolist())
+    params = []
+    with open(path, 'rb') as f:
+        for k in xrange(n_layers):
+            for name in ('W%i' % k, 'b%i' % k):
+                info = infos[name + '.npy']
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise ValueError('%s is compressed and cannot be memory-mapped' % name)
+                f.seek(_member_offset(f, info))
+                version = npy_format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+                params.append(numpy.memmap(path, dtype=dtype, mode='r', offset=f.tell(),
+                                           shape=shape, order='F' if fortran_order else 'C'))
+    return params
+
+
+class BatchPredictor(object):
+    """Predicts the labels of a stored LogisticRegression or MLP"""
+
+    def __init__(self, path, chunk_size=None, n_threads=1, cache_bytes=1 << 22, mmap=False):
+        """
+        :type path: string
+        :param path: ``.npz`` file written by save_model
+
+        :type chunk_size: int
+        :param chunk_size: rows scored at once; by default as many as keep
+                           the widest activations within cache_bytes
+
+        :type n_threads: int
+        :param n_threads: threads scoring chunks concurrently
+
+        :type mmap: bool
+        :param mmap: memory-map the weights rather than reading them
+        """
+        params = load_params(path, mmap)
+        self.layers = zip(params[0::2], params[1::2])
+        if chunk_size is None:
+            width = max(max(W.shape) for W, b in self.layers)
+            chunk_size = max(cache_bytes // (width * self.layers[0][0].dtype.itemsize), 1)
+        self.chunk_size = chunk_size
+        self.n_threads = n_threads
+
+    def forward(self, x):
+        """class scores (inputs of the softmax) of the rows of x"""
+        for W, b in self.layers[:-1]:
+            x = numpy.tanh(numpy.dot(x, W) + b)
+        W, b = self.layers[-1]
+        return numpy.dot(x, W) + b
+
+    def predict_proba(self, x):
+        out = numpy.empty((x.shape[0], self.layers[-1][1].shape[0]), dtype=self.layers[-1][1].dtype)
+
+        def score(start):
+            s = self.forward(x[start:start + self.chunk_size])
+            s -= s.max(axis=1)[:, None]
+            numpy.exp(s, out=s)
+            s /= s.sum(axis=1)[:, None]
+            out[start:start + self.chunk_size] = s
+
+        self._map(score, x.shape[0])
+        return out
+
+    def predict(self, x):
+        """labels of the rows of x, e.g. a memory-mapped array"""
+        out = numpy.empty(x.shape[0], dtype='int64')
+
+        def score(start):
+            out[start:start + self.chunk_size] = self.forward(x[start:start + self.chunk_size]).argmax(axis=1)
+
+        self._map(score, x.shape[0])
+        return out
+
+    def _map(self, score, n):
+        starts = xrange(0, n, self.chunk_size)
+        if self.n_threads > 1:
+            pool = ThreadPool(self.n_threads)
+            try:
+                pool.map(score, starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for start in starts:
+                score(start)
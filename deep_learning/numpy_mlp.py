@@ -0,0 +1,286 @@
+"""
+The multilayer perceptron of mlp.py in plain numpy.
+
+HiddenLayer, LogisticRegression and MLP mirror their Theano counterparts:
+``params`` lists the parameter arrays in the same order, and
+``negative_log_likelihood``, ``errors``, ``L1``, ``L2_sqr`` and ``augment``
+have the same meaning. Theano binds a model to a symbolic input; here the
+input is whatever was last passed to ``forward``. Nothing is compiled, so a
+trainer using this backend starts immediately.
+
+The backward pass is written out by hand. Activations, deltas and gradients
+go to buffers that are allocated once per minibatch size and reused, and
+sgd_step applies the update in place, so a training step does not allocate
+arrays proportional to the model or the minibatch.
+
+Parameters created here follow theano.config.floatX, like the Theano
+models (see logistic_sgd.set_precision); this module only imports Theano
+for that, and falls back to float32 without it.
+"""
+__docformat__ = 'restructedtext en'
+
+import numpy
+
+
+def _floatX(dtype=None):
+    """dtype, by default theano.config.floatX"""
+    if dtype is not None:
+        return dtype
+    try:
+        import theano
+    except ImportError:
+        return 'float32'
+    return theano.config.floatX
+
+
+class _Buffers(object):
+    """arrays reused across calls, (re)allocated when their shape changes"""
+
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name, shape, dtype):
+        a = self.arrays.get(name)
+        if a is None or a.shape != shape or a.dtype != dtype:
+            a = self.arrays[name] = numpy.empty(shape, dtype=dtype)
+        return a
+
+
+class HiddenLayer(object):
+    def __init__(self, rng, n_in, n_out, W=None, b=None, dtype=None):
+        """
+        Fully-connected tanh layer, tanh(dot(input, W) + b), initialized like
+        mlp.HiddenLayer
+
+        :type rng: numpy.random.RandomState
+        :param rng: a random number generator used to initialize weights
+
+        :type W: numpy.ndarray
+        :param W: optional initial weights (used in place, not copied)
+
+        :type b: numpy.ndarray
+        :param b: optional initial biases (used in place, not copied)
+
+        :type dtype: string
+        :param dtype: type of the parameters created here, theano.config.floatX
+                      by default
+        """
+        dtype = _floatX(dtype)
+        if W is None:
+            W = numpy.asarray(
+                rng.uniform(
+                    low=-numpy.sqrt(6. / (n_in + n_out)),
+                    high=numpy.sqrt(6. / (n_in + n_out)),
+                    size=(n_in, n_out)
+                ),
+                dtype=dtype
+            )
+        if b is None:
+            b = numpy.zeros((n_out,), dtype=dtype)
+        self.W = W
+        self.b = b
+        self.gW = numpy.empty_like(W)
+        self.gb = numpy.empty_like(b)
+        self.params = [self.W, self.b]
+        self.gparams = [self.gW, self.gb]
+        self.buffers = _Buffers()
+
+    def forward(self, input):
+        self.input = input = numpy.asarray(input, dtype=self.W.dtype)
+        out = self.buffers.get('output', (input.shape[0], self.W.shape[1]), self.W.dtype)
+        numpy.dot(input, self.W, out=out)
+        out += self.b
+        numpy.tanh(out, out=out)
+        self.output = out
+        return out
+
+    def backward(self, delta_out, need_input_delta=True):
+        """
+        fill gW, gb from the gradient w.r.t. the output (which is clobbered)
+        and return the gradient w.r.t. the input
+        """
+        # tanh' = 1 - tanh ** 2, applied in place to the incoming gradient
+        sq = self.buffers.get('sq', self.output.shape, self.output.dtype)
+        numpy.multiply(self.output, self.output, out=sq)
+        numpy.subtract(1, sq, out=sq)
+        delta_out *= sq
+        numpy.dot(self.input.T, delta_out, out=self.gW)
+        delta_out.sum(axis=0, out=self.gb)
+        if not need_input_delta:
+            return None
+        delta_in = self.buffers.get('delta_in', self.input.shape, self.W.dtype)
+        numpy.dot(delta_out, self.W.T, out=delta_in)
+        return delta_in
+
+
+class LogisticRegression(object):
+    def __init__(self, n_in, n_out, W=None, b=None, dtype=None):
+        """softmax layer, zero-initialized like logistic_sgd.LogisticRegression"""
+        dtype = _floatX(dtype)
+        self.W = numpy.zeros((n_in, n_out), dtype=dtype) if W is None else W
+        self.b = numpy.zeros((n_out,), dtype=dtype) if b is None else b
+        self.gW = numpy.empty_like(self.W)
+        self.gb = numpy.empty_like(self.b)
+        self.params = [self.W, self.b]
+        self.gparams = [self.gW, self.gb]
+        self.buffers = _Buffers()
+
+    def forward(self, input):
+        self.input = input = numpy.asarray(input, dtype=self.W.dtype)
+        p = self.buffers.get('p_y_given_x', (input.shape[0], self.W.shape[1]), self.W.dtype)
+        numpy.dot(input, self.W, out=p)
+        p += self.b
+        p -= p.max(axis=1)[:, None]
+        numpy.exp(p, out=p)
+        p /= p.sum(axis=1)[:, None]
+        self.p_y_given_x = p
+        return p
+
+    @property
+    def y_pred(self):
+        return self.p_y_given_x.argmax(axis=1)
+
+    def negative_log_likelihood(self, y):
+        """mean negative log-likelihood of the labels y under the last forward"""
+        return -numpy.mean(numpy.log(self.p_y_given_x[numpy.arange(y.shape[0]), y]))
+
+    def errors(self, y):
+        """zero one loss of the last forward over the labels y"""
+        return numpy.mean(self.y_pred != y)
+
+    def backward(self, y, need_input_delta=True):
+        """
+        fill gW, gb with the gradient of negative_log_likelihood(y) and
+        return the gradient w.r.t. the input
+        """
+        n = y.shape[0]
+        delta = self.buffers.get('delta', self.p_y_given_x.shape, self.W.dtype)
+        delta[...] = self.p_y_given_x
+        delta[numpy.arange(n), y] -= 1
+        delta /= n
+        numpy.dot(self.input.T, delta, out=self.gW)
+        delta.sum(axis=0, out=self.gb)
+        if not need_input_delta:
+            return None
+        delta_in = self.buffers.get('delta_in', self.input.shape, self.W.dtype)
+        numpy.dot(delta, self.W.T, out=delta_in)
+        return delta_in
+
+
+class MLP(object):
+    """Multi-Layer Perceptron with tanh hidden layers and a softmax output"""
+
+    def __init__(self, rng, n_in, n_hidden, n_out, params=None, dtype=None):
+        """
+        :type n_hidden: int or list of int
+        :param n_hidden: number of hidden units, or the widths of the hidden
+                         layers from the input up
+
+        :type params: list of numpy.ndarray
+        :param params: optional (W, b) of every layer, input layer first,
+                       used in place (e.g. views on shared memory)
+
+        :type dtype: string
+        :param dtype: type of the parameters created here, theano.config.floatX
+                      by default
+        """
+        if isinstance(n_hidden, (int, long)):
+            n_hidden = [n_hidden]
+        if params is None:
+            params = [None] * (2 * len(n_hidden) + 2)
+        widths = [n_in] + list(n_hidden)
+        self.hiddenLayers = [HiddenLayer(rng, widths[k], widths[k + 1], W=params[2 * k], b=params[2 * k + 1],
+                                         dtype=dtype)
+                             for k in xrange(len(n_hidden))]
+        self.hiddenLayer = self.hiddenLayers[0]
+        self.logRegressionLayer = LogisticRegression(widths[-1], n_out, W=params[-2], b=params[-1], dtype=dtype)
+        self.layers = self.hiddenLayers + [self.logRegressionLayer]
+        self.params = [p for layer in self.layers for p in layer.params]
+        self.gparams = [g for layer in self.layers for g in layer.gparams]
+        self.negative_log_likelihood = self.logRegressionLayer.negative_log_likelihood
+        self.errors = self.logRegressionLayer.errors
+
+    def set_params(self, params):
+        """make the model use the given arrays as its parameters (no copy)"""
+        for k, layer in enumerate(self.layers):
+            layer.W, layer.b = params[2 * k], params[2 * k + 1]
+            layer.params = [layer.W, layer.b]
+        self.params = list(params)
+
+    @property
+    def L1(self):
+        return sum(abs(layer.W).sum() for layer in self.layers)
+
+    @property
+    def L2_sqr(self):
+        return sum((layer.W ** 2).sum() for layer in self.layers)
+
+    def augment(self, aug1, aug2, weights=None):
+        if weights is None:
+            weights = [1.] * len(self.params)
+        return numpy.sum([w * ((x[0] - x[1] + x[2]) ** 2).sum()
+                          for x, w in zip(zip(self.params, aug1, aug2), weights)])
+
+    def forward(self, x):
+        for layer in self.layers:
+            x = layer.forward(x)
+        return x
+
+    def grad(self, x, y, L1_reg=0., L2_reg=0., rho=0., z=None, duals=None):
+        """
+        cost of mlp.test_mlp (plus 0.5 * rho * augment(z, duals) if z is
+        given, rho being a scalar or one value per parameter) on the
+        minibatch (x, y); its gradients are left in gparams
+        """
+        self.forward(x)
+        cost = self.negative_log_likelihood(y)
+        delta = self.logRegressionLayer.backward(y, need_input_delta=bool(self.hiddenLayers))
+        for k in xrange(len(self.hiddenLayers) - 1, -1, -1):
+            delta = self.hiddenLayers[k].backward(delta, need_input_delta=k > 0)
+        for layer in self.layers:
+            if L1_reg:
+                layer.gW += L1_reg * numpy.sign(layer.W)
+            if L2_reg:
+                layer.gW += 2 * L2_reg * layer.W
+        cost += L1_reg * self.L1 + L2_reg * self.L2_sqr
+        if z is not None:
+            rhos = rho if isinstance(rho, (list, tuple)) else [rho] * len(self.params)
+            for p, g, zk, u, r_k in zip(self.params, self.gparams, z, duals, rhos):
+                r = p - zk
+                r += u
+                r *= r_k
+                g += r
+            cost += 0.5 * self.augment(z, duals, rhos)
+        return cost
+
+    def sgd_step(self, x, y, learning_rate, L1_reg=0., L2_reg=0., rho=0., z=None, duals=None):
+        """one gradient step on (x, y), in place; returns the cost before it"""
+        cost = self.grad(x, y, L1_reg, L2_reg, rho, z, duals)
+        for p, g in zip(self.params, self.gparams):
+            g *= learning_rate
+            p -= g
+        return cost
+
+
+def local_update(n_in, n_hidden, n_out, L1_reg, L2_reg):
+    """
+    The numpy counterpart of admm_pool.compile_local_update: a function
+
+        (x, y, params, z, duals, rhos) -> [cost] + gradients
+
+    over the parameters of any worker. The returned gradients are buffers
+    that the next call overwrites.
+    """
+    models = []
+
+    def update(x, y, *arrays):
+        n = len(arrays) // 4
+        params, z, duals, rhos = arrays[:n], arrays[n:2 * n], arrays[2 * n:3 * n], list(arrays[3 * n:])
+        if not models:
+            models.append(MLP(None, n_in, n_hidden, n_out, params=list(params)))
+        model = models[0]
+        # the same model (and gradient buffers) serves every worker
+        model.set_params(params)
+        return [model.grad(x, y, L1_reg, L2_reg, rhos, z, duals)] + model.gparams
+
+    return update
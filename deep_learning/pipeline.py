@@ -0,0 +1,114 @@
+"""
+Streaming minibatches for the trainers.
+
+Instead of keeping the whole training set in a shared variable and slicing
+it by minibatch index, MinibatchStream reads the rows straight from (memory
+mapped) arrays such as the ones of logistic_sgd.cached_splits. Every epoch
+visits the blocks of block_size contiguous rows in a random order and the
+rows of each block in a random order, so reads stay local to a block while
+the minibatches are shuffled. A background thread assembles the minibatches
+into a small ring of preallocated buffers ahead of the consumer, so that the
+compiled training function does not wait on the disk or on the gathering.
+"""
+__docformat__ = 'restructedtext en'
+
+import threading
+from Queue import Queue
+
+import numpy
+
+
+class MinibatchStream(object):
+    """Shuffled, prefetched minibatches over an (input, target) pair of arrays"""
+
+    def __init__(self, data_x, data_y, batch_size, block_size=None, n_buffers=3,
+                 shuffle=True, rng=None, y_dtype='int32'):
+        """
+        :type data_x: numpy.ndarray or numpy.memmap
+        :param data_x: inputs, one example per row
+
+        :type data_y: numpy.ndarray or numpy.memmap
+        :param data_y: targets, one per row of data_x
+
+        :type batch_size: int
+        :param batch_size: rows per minibatch; the rows left over after the
+                           last full minibatch are skipped, as elsewhere
+
+        :type block_size: int
+        :param block_size: rows per shuffling block, by default 16 minibatches
+
+        :type n_buffers: int
+        :param n_buffers: minibatch buffers in the ring, i.e. how far the
+                          background thread may run ahead plus one
+
+        :type shuffle: bool
+        :param shuffle: if False, the minibatches come in the stored order
+        """
+        self.data_x = data_x
+        self.data_y = data_y
+        self.batch_size = batch_size
+        self.block_size = block_size or 16 * batch_size
+        self.shuffle = shuffle
+        self.rng = rng if rng is not None else numpy.random.RandomState(1234)
+        self.n_batches = data_x.shape[0] // batch_size
+        self.buffers = [(numpy.empty((batch_size,) + data_x.shape[1:], dtype=data_x.dtype),
+                         numpy.empty((batch_size,), dtype=y_dtype))
+                        for i in xrange(n_buffers)]
+
+    def __len__(self):
+        return self.n_batches
+
+    def order(self):
+        """row order of one epoch: blocks shuffled, then rows within blocks"""
+        n = self.data_x.shape[0]
+        if not self.shuffle:
+            return numpy.arange(n)
+        starts = numpy.arange(0, n, self.block_size)
+        self.rng.shuffle(starts)
+        return numpy.concatenate([start + self.rng.permutation(min(self.block_size, n - start))
+                                  for start in starts])
+
+    def _fill(self, rows, free, filled, stop):
+        try:
+            for k in xrange(self.n_batches):
+                i = free.get()
+                if stop.is_set():
+                    return
+                batch = rows[k * self.batch_size:(k + 1) * self.batch_size]
+                # reading the rows in storage order keeps memory-mapped
+                # reads sequential within the (at most two) blocks involved
+                batch.sort()
+                buf_x, buf_y = self.buffers[i]
+                numpy.take(self.data_x, batch, axis=0, out=buf_x)
+                buf_y[...] = numpy.take(self.data_y, batch)
+                filled.put(i)
+        except Exception as e:
+            filled.put(e)
+
+    def __iter__(self):
+        """
+        one epoch of (x, y) minibatches. The arrays are buffers of the ring
+        and are overwritten once the next minibatch has been requested, so
+        they must be consumed (e.g. passed to a compiled function) before
+        that
+        """
+        free = Queue()
+        filled = Queue()
+        stop = threading.Event()
+        for i in xrange(len(self.buffers)):
+            free.put(i)
+        thread = threading.Thread(target=self._fill, args=(self.order(), free, filled, stop))
+        thread.daemon = True
+        thread.start()
+        try:
+            for k in xrange(self.n_batches):
+                i = filled.get()
+                if isinstance(i, Exception):
+                    raise i
+                yield self.buffers[i]
+                free.put(i)
+        finally:
+            # wake the thread up if the consumer stopped early
+            stop.set()
+            free.put(None)
+            thread.join()
@@ -0,0 +1,71 @@
+"""
+Communication graphs for decentralized ADMM.
+
+Instead of averaging all workers into one consensus variable, every worker
+of a decentralized run only exchanges parameters with its neighbours in a
+graph (Shi et al., "On the Linear Convergence of the ADMM in Decentralized
+Consensus Optimization", 2014). A graph is given as an (n_workers, degree)
+integer array whose row i lists the neighbours of worker i. All graphs here
+are regular, so every worker talks to the same number of neighbours per
+round, however many workers there are:
+
+    ring          worker i and i +- 1                          degree 2
+    torus         a rows x cols grid wrapping around           degree 4
+    expander:d    union of d / 2 random Hamiltonian cycles,    degree d
+                  an expander with high probability
+"""
+__docformat__ = 'restructedtext en'
+
+import numpy
+
+
+def ring(n):
+    if n < 3:
+        raise ValueError('a ring needs at least 3 workers, got %i' % n)
+    i = numpy.arange(n)
+    return numpy.column_stack([(i - 1) % n, (i + 1) % n])
+
+
+def torus(n):
+    """the squarest rows x cols grid of n workers, both sides at least 3"""
+    rows = max(r for r in xrange(1, int(numpy.sqrt(n)) + 1) if n % r == 0)
+    cols = n // rows
+    if rows < 3:
+        raise ValueError('%i workers do not form a torus of at least 3 x 3' % n)
+    r, c = numpy.divmod(numpy.arange(n), cols)
+    return numpy.column_stack([((r - 1) % rows) * cols + c, ((r + 1) % rows) * cols + c,
+                               r * cols + (c - 1) % cols, r * cols + (c + 1) % cols])
+
+
+def expander(n, degree=4, rng=None, max_tries=1000):
+    """random degree-regular graph without repeated edges"""
+    if degree % 2 or not 2 <= degree < n:
+        raise ValueError('the degree must be even and between 2 and %i, got %i' % (n - 1, degree))
+    rng = rng if rng is not None else numpy.random.RandomState(1234)
+    neighbours = numpy.empty((n, 0), dtype='int64')
+    tries = 0
+    while neighbours.shape[1] < degree:
+        # a random Hamiltonian cycle, kept if it adds no edge twice
+        cycle = rng.permutation(n)
+        pred = numpy.empty(n, dtype='int64')
+        pred[cycle] = numpy.roll(cycle, 1)
+        succ = numpy.empty(n, dtype='int64')
+        succ[cycle] = numpy.roll(cycle, -1)
+        if not (neighbours == pred[:, None]).any() and not (neighbours == succ[:, None]).any() \
+                and (pred != succ).all():
+            neighbours = numpy.column_stack([neighbours, pred, succ])
+        tries += 1
+        if tries == max_tries:
+            raise ValueError('no simple %i-regular graph on %i workers found' % (degree, n))
+    return neighbours
+
+
+def make_topology(spec, n, rng=None):
+    """neighbours of n workers from 'ring', 'torus', 'expander' or 'expander:<degree>'"""
+    if spec == 'ring':
+        return ring(n)
+    if spec == 'torus':
+        return torus(n)
+    if spec.startswith('expander'):
+        return expander(n, int(spec.split(':')[1]), rng) if ':' in spec else expander(n, rng=rng)
+    raise ValueError('unknown topology %r' % spec)
@@ -0,0 +1,140 @@
+"""
+Decentralized rounds of the ADMM worker pool on the numpy backend, with the
+local solves and the neighbour mixes in pool processes.
+"""
+__author__ = 'haohanwang'
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'deep_learning'))
+
+from admm_pool import WorkerPool, worker_shards, shard_stream, stream_schedule
+from topology import make_topology
+
+N_WORKERS = 9
+BATCH = 20
+SHAPE = (5, 4, 3)
+
+
+def dataset(seed=0):
+    rng = numpy.random.RandomState(seed)
+    x = rng.randn(N_WORKERS * BATCH, SHAPE[0])
+    return x, numpy.argmax(numpy.dot(x, rng.randn(SHAPE[0], SHAPE[2])), axis=1).astype('int32')
+
+
+def make_pool(neighbours, n_procs=2, rho=0.5, train=None, stream=False):
+    x, y = train if train is not None else dataset()
+    rng = numpy.random.RandomState(1)
+    n_in, n_hidden, n_out = SHAPE
+    init = [rng.uniform(-1, 1, (N_WORKERS, n_in, n_hidden)), rng.uniform(-1, 1, (N_WORKERS, n_hidden)),
+            rng.uniform(-1, 1, (N_WORKERS, n_hidden, n_out)), rng.uniform(-1, 1, (N_WORKERS, n_out))]
+    return WorkerPool(n_procs, x, y, worker_shards(N_WORKERS, N_WORKERS, BATCH), init,
+                      n_in=n_in, n_hidden=n_hidden, n_out=n_out, learning_rate=0.1,
+                      L1_reg=0., L2_reg=0., rho=2 * neighbours.shape[1] * rho,
+                      backend='numpy', neighbours=neighbours, stream=stream)
+
+
+def disagreement(pool):
+    """largest distance of a worker's parameters from the workers' mean"""
+    return max(numpy.sqrt(((w - w.mean(axis=0)) ** 2).sum(axis=tuple(range(1, w.ndim)))).max()
+               for w in pool.params)
+
+
+class MixRoundTest(unittest.TestCase):
+
+    def test_mix_uses_only_the_neighbours(self):
+        neighbours = make_topology('ring', N_WORKERS)
+        pool = make_pool(neighbours)
+        try:
+            rng = numpy.random.RandomState(1)
+            for u in pool.duals:
+                u[...] = rng.randn(*u.shape)
+            w = [p.copy() for p in pool.params]
+            u = [d.copy() for d in pool.duals]
+            pool.mix_round()
+            for k in range(len(w)):
+                xbar = (w[k][neighbours[:, 0]] + w[k][neighbours[:, 1]]) / 2
+                numpy.testing.assert_allclose(pool.duals[k], u[k] + (w[k] - xbar) / 2)
+                numpy.testing.assert_allclose(pool.z[k], (w[k] + xbar) / 2)
+                # the mix leaves the parameters alone
+                numpy.testing.assert_array_equal(pool.params[k], w[k])
+        finally:
+            pool.close()
+
+    def test_mix_of_some_tensors(self):
+        pool = make_pool(make_topology('ring', N_WORKERS))
+        try:
+            pool.mix_round([1])
+            self.assertFalse(pool.z[0].any())
+            self.assertTrue(pool.z[1].any())
+        finally:
+            pool.close()
+
+    def test_ring_and_torus_reach_consensus(self):
+        for topology in ('ring', 'torus'):
+            pool = make_pool(make_topology(topology, N_WORKERS))
+            try:
+                start = disagreement(pool)
+                for k in range(400):
+                    pool.run_round()
+                    pool.mix_round()
+                self.assertLess(disagreement(pool), 0.01 * start, topology)
+            finally:
+                pool.close()
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_x = numpy.repeat(numpy.arange(100, dtype='float64')[:, None], 2, axis=1)
+        self.data_y = numpy.zeros(100)
+
+    def rows(self, schedule):
+        return [numpy.array(x[:, 0], dtype='int64') for x, y in schedule]
+
+    def test_inner_steps_stay_in_the_shard(self):
+        stream = shard_stream(self.data_x, self.data_y, (40, 60), 5, worker=2, epoch=1)
+        rows = self.rows(stream_schedule(stream, inner_steps=10))
+        self.assertEqual(len(rows), 10)
+        # two passes, each over every row of the shard once
+        for half in (rows[:4], rows[4:8]):
+            self.assertEqual(sorted(numpy.concatenate(half)), list(range(40, 60)))
+
+    def test_shuffling_depends_on_worker_and_epoch_only(self):
+        def order(worker, epoch):
+            stream = shard_stream(self.data_x, self.data_y, (0, 20), 5, worker, epoch)
+            return numpy.concatenate(self.rows(stream_schedule(stream)))
+        numpy.testing.assert_array_equal(order(0, 3), order(0, 3))
+        self.assertFalse((order(0, 3) == order(0, 4)).all())
+        self.assertFalse((order(0, 3) == order(1, 3)).all())
+
+    def test_streamed_pool_reads_memory_mapped_shards(self):
+        neighbours = make_topology('ring', N_WORKERS)
+        directory = tempfile.mkdtemp()
+        try:
+            for name, value in zip('xy', dataset()):
+                numpy.save(os.path.join(directory, name + '.npy'), value)
+            train_x = numpy.load(os.path.join(directory, 'x.npy'), mmap_mode='r')
+            train_y = numpy.load(os.path.join(directory, 'y.npy'), mmap_mode='r')
+            pool = make_pool(neighbours, train=(train_x, train_y), stream=True)
+            try:
+                start = disagreement(pool)
+                for epoch in range(400):
+                    results = pool.run_round(epoch=epoch)
+                    pool.mix_round()
+                self.assertEqual([k for c, k in results], [1] * N_WORKERS)
+                self.assertLess(disagreement(pool), 0.01 * start)
+            finally:
+                pool.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
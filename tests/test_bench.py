@@ -0,0 +1,56 @@
+"""
+Tests of the regression flags of the benchmark suite.
+"""
+__author__ = 'haohanwang'
+
+import copy
+import unittest
+
+from benchmark import bench
+
+
+def result(**fields):
+    r = {'problem': 'lasso', 'n': 200, 'p': 50, 'density': 1., 'cond': 10., 'seed': 0,
+         'time': 1., 'iterations': 100, 'converged': True,
+         'peak_rss': 50000, 'peak_alloc': 10 << 20, 'alloc_method': 'tracemalloc'}
+    r.update(fields)
+    return {'meta': {}, 'results': [r]}
+
+
+def flagged(base, new, threshold=0.1):
+    return [field for key, field, o, n in bench.compare(base, new, threshold)]
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_identical_runs_are_not_flagged(self):
+        base = result()
+        self.assertEqual(flagged(base, copy.deepcopy(base)), [])
+
+    def test_time_and_iterations_beyond_the_threshold(self):
+        self.assertEqual(flagged(result(), result(time=1.05, iterations=105)), [])
+        self.assertEqual(flagged(result(), result(time=1.2)), ['time'])
+        self.assertEqual(flagged(result(), result(iterations=120)), ['iterations'])
+        self.assertEqual(flagged(result(), result(time=1.2), threshold=0.5), [])
+
+    def test_memory_needs_to_grow_by_more_than_the_slack(self):
+        # doubled, but by less than MEMORY_SLACK
+        self.assertEqual(flagged(result(peak_alloc=1 << 16), result(peak_alloc=1 << 17)), [])
+        self.assertEqual(flagged(result(peak_rss=100), result(peak_rss=200)), [])
+        self.assertEqual(flagged(result(), result(peak_alloc=20 << 20)), ['peak_alloc'])
+        self.assertEqual(flagged(result(), result(peak_rss=100000)), ['peak_rss'])
+
+    def test_allocations_measured_differently_are_not_compared(self):
+        self.assertEqual(flagged(result(), result(peak_alloc=20 << 20, alloc_method='rss')), [])
+        self.assertEqual(flagged(result(), result(peak_alloc=None, alloc_method=None)), [])
+
+    def test_lost_convergence(self):
+        self.assertEqual(flagged(result(), result(converged=False)), ['converged'])
+        self.assertEqual(flagged(result(converged=False), result()), [])
+
+    def test_new_cases_are_skipped(self):
+        self.assertEqual(flagged(result(), result(n=400, time=10.)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+Saving, publishing and restoring training checkpoints.
+"""
+__author__ = 'haohanwang'
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'deep_learning'))
+
+from checkpoint import save_checkpoint, load_checkpoint, restore, LATEST
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = numpy.random.RandomState(0)
+        self.arrays = {'param0': rng.randn(4, 3), 'param1': rng.randn(3).astype('float32'),
+                       'rho0': numpy.array([0.5, 2.])}
+        self.state = {'epoch': 7, 'best_validation_loss': 0.25, 'rng': rng.get_state()}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        save_checkpoint(self.directory, self.arrays, self.state)
+        arrays, state = load_checkpoint(self.directory)
+        self.assertEqual(sorted(arrays), sorted(self.arrays))
+        for name, value in self.arrays.items():
+            self.assertEqual(arrays[name].dtype, value.dtype)
+            numpy.testing.assert_array_equal(arrays[name], value)
+        self.assertEqual(state['epoch'], 7)
+        rng = numpy.random.RandomState()
+        rng.set_state(state['rng'])
+        expected = numpy.random.RandomState()
+        expected.set_state(self.state['rng'])
+        self.assertEqual(rng.randn(), expected.randn())
+
+    def test_restore_into_live_buffers(self):
+        save_checkpoint(self.directory, self.arrays, self.state)
+        arrays, state = load_checkpoint(self.directory)
+        live = [numpy.zeros((4, 3)), numpy.zeros(3, dtype='float32')]
+        restore(live, [arrays['param0'], arrays['param1']])
+        numpy.testing.assert_array_equal(live[0], self.arrays['param0'])
+        numpy.testing.assert_array_equal(live[1], self.arrays['param1'])
+
+    def test_no_checkpoint(self):
+        self.assertIsNone(load_checkpoint(self.directory))
+        self.assertIsNone(load_checkpoint(os.path.join(self.directory, 'missing')))
+
+    def test_newer_checkpoint_replaces_older_ones_only(self):
+        foreign = ['00000003-data', 'results', 'ckpt-notes']
+        for name in foreign:
+            os.mkdir(os.path.join(self.directory, name))
+        save_checkpoint(self.directory, self.arrays, self.state)
+        self.state['epoch'] = 8
+        self.arrays['param0'] += 1
+        save_checkpoint(self.directory, self.arrays, self.state)
+        arrays, state = load_checkpoint(self.directory)
+        self.assertEqual(state['epoch'], 8)
+        numpy.testing.assert_array_equal(arrays['param0'], self.arrays['param0'])
+        checkpoints = [e for e in os.listdir(self.directory) if e.startswith('ckpt-0')]
+        self.assertEqual(len(checkpoints), 1)
+        self.assertTrue(checkpoints[0].startswith('ckpt-00000008-'))
+        self.assertEqual(sorted(set(os.listdir(self.directory)) - set(checkpoints)),
+                         sorted(foreign + [LATEST]))
+
+
+if __name__ == '__main__':
+    unittest.main()
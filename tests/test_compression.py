@@ -0,0 +1,94 @@
+"""
+The message codecs and the error feedback of compression.Link.
+"""
+__author__ = 'haohanwang'
+
+import unittest
+
+import numpy as np
+
+from ADMM import compression
+
+CODECS = ['raw', 'q8', 'q1', 'topk', 'topk:0.1', 'topk+q8', 'topk+q8:0.1']
+
+
+class CodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.delta = np.random.RandomState(0).randn(101)
+
+    def test_payload_size_only_depends_on_the_length(self):
+        for spec in CODECS:
+            codec = compression.make_codec(spec)
+            for delta in (self.delta, np.zeros(101), 1e6 * self.delta):
+                payload = codec.encode(delta)
+                self.assertEqual(payload.dtype, np.uint8, spec)
+                self.assertEqual(payload.size, codec.payload_bytes(delta.size), spec)
+
+    def test_raw_is_lossless_and_copies_nothing(self):
+        codec = compression.make_codec('raw')
+        payload = codec.encode(self.delta)
+        self.assertTrue(np.shares_memory(payload, self.delta))
+        decoded = codec.decode(payload, self.delta.size)
+        np.testing.assert_array_equal(decoded, self.delta)
+        self.assertTrue(np.shares_memory(decoded, self.delta))
+
+    def test_q8_error_is_within_half_a_level(self):
+        codec = compression.make_codec('q8')
+        decoded = codec.decode(codec.encode(self.delta), self.delta.size)
+        level = np.abs(self.delta).max() / 127.
+        self.assertLessEqual(np.abs(decoded - self.delta).max(), 0.5 * level + 1e-12)
+
+    def test_q1_keeps_the_signs(self):
+        codec = compression.make_codec('q1')
+        decoded = codec.decode(codec.encode(self.delta), self.delta.size)
+        np.testing.assert_array_equal(np.sign(decoded), np.where(self.delta >= 0, 1, -1))
+        np.testing.assert_allclose(np.abs(decoded), np.abs(self.delta).mean())
+
+    def test_topk_keeps_the_largest_entries(self):
+        for spec in ('topk:0.1', 'topk+q8:0.1'):
+            codec = compression.make_codec(spec)
+            decoded = codec.decode(codec.encode(self.delta), self.delta.size)
+            kept = np.flatnonzero(decoded)
+            largest = np.argsort(np.abs(self.delta))[-codec.k(self.delta.size):]
+            self.assertEqual(sorted(kept), sorted(largest), spec)
+            np.testing.assert_allclose(decoded[kept], self.delta[kept], rtol=1e-2, atol=1e-6)
+
+    def test_zero_change(self):
+        for spec in CODECS:
+            codec = compression.make_codec(spec)
+            decoded = codec.decode(codec.encode(np.zeros(101)), 101)
+            np.testing.assert_array_equal(decoded, 0, spec)
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, compression.make_codec, 'zip')
+
+
+class LinkTest(unittest.TestCase):
+
+    def test_both_ends_keep_the_same_copy(self):
+        rng = np.random.RandomState(1)
+        for spec in CODECS[1:]:
+            sender, receiver = compression.Link(spec, 50), compression.Link(spec, 50)
+            for k in range(20):
+                copy = receiver.receive(sender.send(rng.randn(50)))
+                np.testing.assert_array_equal(copy, sender.ref, spec)
+
+    def test_error_feedback_converges_to_a_fixed_value(self):
+        value = np.random.RandomState(2).randn(200)
+        for spec in ('q8', 'topk:0.1', 'topk+q8:0.3'):
+            sender, receiver = compression.Link(spec, 200), compression.Link(spec, 200)
+            for k in range(100):
+                copy = receiver.receive(sender.send(value))
+            # whatever a round drops is sent in a later one
+            np.testing.assert_allclose(copy, value, atol=1e-3, err_msg=spec)
+
+    def test_reset(self):
+        link = compression.Link('q8', 10)
+        link.send(np.ones(10))
+        link.reset()
+        np.testing.assert_array_equal(link.ref, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
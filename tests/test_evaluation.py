@@ -0,0 +1,67 @@
+"""
+Scheduling of parameter snapshots by AsyncEvaluator, with a scorer that is
+slower than the training loop.
+"""
+__author__ = 'haohanwang'
+
+import os
+import sys
+import time
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'deep_learning'))
+
+import evaluation
+
+
+def slow_scorer(classifier, x, y, valid_set, test_set, snapshots, results):
+    """scores a snapshot as its first value, after valid_set seconds"""
+    while True:
+        msg = snapshots.get()
+        if msg is None:
+            break
+        tag, values = msg
+        time.sleep(valid_set)
+        results.put((tag, float(values[0][0]), None))
+
+
+class AsyncEvaluatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scorer = evaluation._evaluate_snapshots
+        evaluation._evaluate_snapshots = slow_scorer
+
+    def tearDown(self):
+        evaluation._evaluate_snapshots = self.scorer
+
+    def test_submit_does_not_wait_for_slow_scoring(self):
+        evaluator = evaluation.AsyncEvaluator(None, None, None, 0.3, None)
+        try:
+            start = time.time()
+            for epoch in range(5):
+                evaluator.submit(epoch, [numpy.array([epoch])])
+            self.assertLess(time.time() - start, 0.3)
+            results = list(evaluator.results(wait=True))
+        finally:
+            evaluator.close()
+        # the first snapshot was being scored while 1 to 3 were superseded
+        self.assertEqual([(tag, loss) for tag, loss, test in results], [(0, 0.), (4, 4.)])
+
+    def test_every_snapshot_is_scored_when_scoring_keeps_up(self):
+        evaluator = evaluation.AsyncEvaluator(None, None, None, 0., None)
+        try:
+            tags = []
+            for epoch in range(5):
+                evaluator.submit(epoch, [numpy.array([epoch])])
+                time.sleep(0.1)
+                tags += [tag for tag, loss, test in evaluator.results()]
+            tags += [tag for tag, loss, test in evaluator.results(wait=True)]
+        finally:
+            evaluator.close()
+        self.assertEqual(tags, list(range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+The fused z/dual/residual kernels against the updates written out plainly.
+"""
+__author__ = 'haohanwang'
+
+import unittest
+
+import numpy as np
+
+from ADMM import kernels
+
+BACKENDS = ['numpy'] + (['numba'] if kernels.numba is not None else [])
+
+
+class KernelsTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.randn(6, 40)
+        self.y = rng.randn(6, 40)
+        self.z = rng.randn(40)
+        self.rho, self.kappa = 2., 0.3
+
+    def test_z_dual_update(self):
+        x, y0, z0 = self.x[0], self.y[0], self.z
+        z_ref = kernels.soft_threshold(x + y0 / self.rho, self.kappa)
+        y_ref = y0 + self.rho * (x - z_ref)
+        for backend in BACKENDS:
+            z, y = z0.copy(), y0.copy()
+            r, s = kernels.z_dual_update(x, z, y, self.rho, self.kappa, backend=backend)
+            np.testing.assert_allclose(z, z_ref)
+            np.testing.assert_allclose(y, y_ref)
+            self.assertAlmostEqual(r, np.linalg.norm(x - z_ref))
+            self.assertAlmostEqual(s, self.rho * np.linalg.norm(z_ref - z0))
+
+    def test_consensus_update(self):
+        active = np.arange(6) % 2 == 0
+        z_ref = kernels.soft_threshold((self.x + self.y / self.rho).mean(axis=0), self.kappa)
+        y_ref = self.y.copy()
+        y_ref[active] += self.rho * (self.x[active] - z_ref)
+        for backend in BACKENDS:
+            z, y = self.z.copy(), self.y.copy()
+            r, s = kernels.consensus_update(self.x, z, y, self.rho, self.kappa, active, backend=backend)
+            np.testing.assert_allclose(z, z_ref)
+            np.testing.assert_allclose(y, y_ref)
+            self.assertAlmostEqual(r, np.linalg.norm(self.x - z_ref))
+            self.assertAlmostEqual(s, self.rho * np.sqrt(6) * np.linalg.norm(z_ref - self.z))
+
+    def test_column_vectors_are_updated_in_place(self):
+        x, z, y = self.x[0].reshape(-1, 1), np.zeros((40, 1)), np.zeros((40, 1))
+        kernels.z_dual_update(x, z, y, self.rho, self.kappa)
+        np.testing.assert_allclose(z[:, 0], kernels.soft_threshold(self.x[0], self.kappa))
+
+    def test_non_contiguous_arrays_are_rejected(self):
+        y = np.zeros((40, 2))[:, 0]
+        self.assertRaises(ValueError, kernels.z_dual_update, self.x[0], self.z.copy(), y, self.rho, self.kappa)
+        self.assertRaises(ValueError, kernels.consensus_update, self.x, self.z.copy(), self.y.T.copy().T,
+                          self.rho, self.kappa)
+
+
+if __name__ == '__main__':
+    unittest.main()
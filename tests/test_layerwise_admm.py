@@ -0,0 +1,64 @@
+"""
+The closed-form block updates of LayerwiseADMM on a small synthetic problem.
+"""
+__author__ = 'haohanwang'
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'deep_learning'))
+
+import numpy_mlp
+from layerwise_admm import LayerwiseADMM
+
+N_HIDDEN = [8, 8]
+
+
+def blobs(n=300, n_in=4, n_out=3, seed=0):
+    rng = numpy.random.RandomState(seed)
+    centers = 2 * rng.randn(n_out, n_in)
+    y = rng.randint(0, n_out, n)
+    return centers[y] + 0.5 * rng.randn(n, n_in), y
+
+
+def train(schedule, n_iter=60, warm_start=5):
+    x, y = blobs()
+    trainer = LayerwiseADMM(numpy.random.RandomState(1), x, y, N_HIDDEN, 3, dtype='float64')
+    residuals = [trainer.iterate(update_multiplier=k >= warm_start, schedule=schedule)
+                 for k in range(n_iter)]
+    model = numpy_mlp.MLP(None, x.shape[1], N_HIDDEN, 3, params=trainer.params())
+    model.forward(x)
+    return residuals, model.errors(y)
+
+
+class LayerwiseADMMTest(unittest.TestCase):
+
+    def test_weights_solve_the_least_squares_fit(self):
+        x, y = blobs()
+        trainer = LayerwiseADMM(numpy.random.RandomState(1), x, y, N_HIDDEN, 3, ridge=0., dtype='float64')
+        W = trainer.solve_weights(1)
+        a = trainer.inputs(1)
+        # the normal equations of min ||a W - Z_1||^2
+        numpy.testing.assert_allclose(numpy.dot(a.T, numpy.dot(a, W) - trainer.Z[1]), 0, atol=1e-8)
+
+    def test_gauss_seidel_sweeps_fit_the_training_set(self):
+        residuals, error = train('gauss-seidel')
+        self.assertLess(residuals[-1], 1e-2 * residuals[0])
+        self.assertLess(error, 0.15)
+
+    def test_jacobi_sweeps_fit_the_training_set(self):
+        residuals, error = train('jacobi', n_iter=100)
+        self.assertLess(residuals[-1], 1e-2 * residuals[0])
+        self.assertLess(error, 0.15)
+
+    def test_unknown_schedule(self):
+        x, y = blobs(n=20)
+        trainer = LayerwiseADMM(numpy.random.RandomState(1), x, y, N_HIDDEN, 3, dtype='float64')
+        self.assertRaises(ValueError, trainer.iterate, schedule='random')
+
+
+if __name__ == '__main__':
+    unittest.main()
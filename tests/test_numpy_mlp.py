@@ -0,0 +1,71 @@
+"""
+The hand-written backward pass of numpy_mlp against finite differences.
+"""
+__author__ = 'haohanwang'
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'deep_learning'))
+
+import numpy_mlp
+
+
+class GradientTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.x = rng.randn(12, 5)
+        self.y = rng.randint(0, 3, 12)
+        self.model = numpy_mlp.MLP(rng, 5, [4, 6], 3, dtype='float64')
+        # a zero-initialized softmax layer would hide errors in its gradient
+        for p in self.model.params:
+            p[...] = rng.uniform(-1, 1, p.shape)
+        self.z = [rng.randn(*p.shape) for p in self.model.params]
+        self.duals = [rng.randn(*p.shape) for p in self.model.params]
+
+    def check(self, **kwargs):
+        def cost():
+            return self.model.grad(self.x, self.y, **kwargs)
+        cost()
+        analytic = [g.copy() for g in self.model.gparams]
+        eps = 1e-6
+        for p, g in zip(self.model.params, analytic):
+            numeric = numpy.zeros_like(p)
+            for i in numpy.ndindex(*p.shape):
+                old = p[i]
+                p[i] = old + eps
+                up = cost()
+                p[i] = old - eps
+                down = cost()
+                p[i] = old
+                numeric[i] = (up - down) / (2 * eps)
+            numpy.testing.assert_allclose(g, numeric, rtol=1e-5, atol=1e-7)
+
+    def test_negative_log_likelihood(self):
+        self.check()
+
+    def test_regularization(self):
+        self.check(L1_reg=0.01, L2_reg=0.001)
+
+    def test_augmented_term(self):
+        self.check(L2_reg=0.001, rho=0.5, z=self.z, duals=self.duals)
+
+    def test_augmented_term_with_a_rho_per_tensor(self):
+        self.check(rho=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6], z=self.z, duals=self.duals)
+
+    def test_sgd_step(self):
+        before = [p.copy() for p in self.model.params]
+        cost = self.model.grad(self.x, self.y, L2_reg=0.001)
+        gradients = [g.copy() for g in self.model.gparams]
+        self.assertEqual(self.model.sgd_step(self.x, self.y, 0.1, L2_reg=0.001), cost)
+        for p, p0, g in zip(self.model.params, before, gradients):
+            numpy.testing.assert_allclose(p, p0 - 0.1 * g)
+        self.assertLess(self.model.grad(self.x, self.y, L2_reg=0.001), cost)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Shuffling and prefetching of MinibatchStream.
+"""
+__author__ = 'haohanwang'
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'deep_learning'))
+
+from pipeline import MinibatchStream
+
+
+def rows_of(stream):
+    """the row indices of every minibatch of one epoch, data_x[k] == k"""
+    return [numpy.array(x[:, 0], dtype='int64') for x, y in stream]
+
+
+class MinibatchStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.n = 103
+        self.data_x = numpy.repeat(numpy.arange(self.n, dtype='float64')[:, None], 3, axis=1)
+        self.data_y = numpy.arange(self.n, dtype='float64') % 10
+
+    def stream(self, **kwargs):
+        return MinibatchStream(self.data_x, self.data_y, 10, block_size=25,
+                               rng=numpy.random.RandomState(0), **kwargs)
+
+    def test_every_epoch_visits_each_row_at_most_once(self):
+        stream = self.stream()
+        self.assertEqual(len(stream), 10)
+        for epoch in range(3):
+            rows = numpy.concatenate(rows_of(stream))
+            self.assertEqual(len(rows), 100)
+            self.assertEqual(len(numpy.unique(rows)), 100)
+
+    def test_epochs_are_shuffled_differently(self):
+        stream = self.stream()
+        first = numpy.concatenate(rows_of(stream))
+        second = numpy.concatenate(rows_of(stream))
+        self.assertFalse((first == numpy.sort(first)).all())
+        self.assertFalse((first == second).all())
+
+    def test_shuffling_stays_within_blocks(self):
+        order = self.stream().order()
+        self.assertEqual(sorted(order), list(range(self.n)))
+        # the rows of a block come one after another
+        for start in range(0, len(order), 25):
+            block = order[start:start + 25]
+            self.assertEqual(len(set(block // 25)), 1)
+
+    def test_unshuffled_order(self):
+        rows = numpy.concatenate(rows_of(self.stream(shuffle=False)))
+        numpy.testing.assert_array_equal(rows, numpy.arange(100))
+
+    def test_labels_follow_their_rows(self):
+        for x, y in self.stream():
+            self.assertEqual(y.dtype, numpy.dtype('int32'))
+            numpy.testing.assert_array_equal(y, x[:, 0] % 10)
+
+    def test_stopping_early_releases_the_thread(self):
+        stream = self.stream()
+        for k, batch in enumerate(stream):
+            if k == 2:
+                break
+        self.assertEqual(len(numpy.concatenate(rows_of(stream))), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""
+TCP consensus: reconnecting workers, and both ends giving up on the other.
+Run from the repository root with python -m unittest discover tests
+"""
+__author__ = 'haohanwang'
+
+import socket
+import unittest
+
+import numpy as np
+
+from ADMM.ConsensusADMM import AsyncConsensusADMM
+from ADMM.TCPConsensus import TCPCoordinator, run_localhost, run_worker
+
+
+def lasso_shards(n_workers=4, n=400, p=20, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.randn(n, p)
+    beta = rng.randn(p, 1) * (rng.rand(p, 1) < 0.3)
+    y = np.dot(X, beta) + 0.01 * rng.randn(n, 1)
+    return np.array_split(X, n_workers), np.array_split(y, n_workers)
+
+
+def unused_address():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    address = s.getsockname()
+    s.close()
+    return address
+
+
+class TCPConsensusTest(unittest.TestCase):
+
+    def test_reconnects_do_not_change_the_solution(self):
+        A, b = lasso_shards()
+        coordinator, (z, x, y) = run_localhost(A, b, 10., 0.1, tol=1e-6, maxIter=2000, drop_after=3)
+        self.assertEqual(coordinator.reconnects, len(A))
+        self.assertTrue(coordinator.iterations < 2000)
+        # the synchronous special case of the multiprocess solver
+        z_ref = AsyncConsensusADMM(10., 0.1, maxIter=2000).run(A, b, tol=1e-6)[0]
+        np.testing.assert_allclose(z, z_ref, atol=1e-4)
+
+    def test_worker_gives_up_without_coordinator(self):
+        A, b = lasso_shards(1)
+        self.assertRaises(socket.error, run_worker, unused_address(), 0, A[0], b[0], 1., retries=2)
+
+    def test_coordinator_gives_up_without_workers(self):
+        coordinator = TCPCoordinator(1., 0.1, 2, 5, worker_timeout=0.5)
+        self.assertRaises(socket.timeout, coordinator.run)
+
+
+if __name__ == '__main__':
+    unittest.main()